@@ -0,0 +1,164 @@
+"""
+Concurrent load test against a running RAG API.
+
+    python benchmarks/load_test.py --url http://localhost:5000 --clients 32 --duration 30
+    python benchmarks/load_test.py --spawn-server --workers 4 --clients 64 --llm-latency 0.5
+
+Every client sends /api/rag/query requests back to back for --duration seconds.
+The report lists throughput, p50/p95/p99 latency of successful queries and the
+status code counts (429 = rejected by the per-worker concurrency limit).
+
+--spawn-server starts src/api/serve.py as a subprocess, answering through a local
+stub LLM server (src/utils/llm_stub.py), and stops it with SIGTERM at the end.
+The tenant needs ingested data for the queries to reach the LLM.
+"""
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import threading
+import subprocess
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+# Ensure project root is in path when run as a script
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+from benchmarks.run_benchmarks import latency_summary, git_commit
+
+QUERIES = [
+    "Which drawer inserts are available in oak?",
+    "What widths does the cutlery tray come in?",
+    "Show me the soft-close hinge options",
+    "Which organisers fit a 600 mm cabinet?",
+    "What colours are available for the pull-out basket?",
+]
+
+
+def spawn_server(args):
+    from src.utils.llm_stub import serve_in_thread
+
+    stub, stub_url = serve_in_thread(latency=args.llm_latency)
+    # Caches off, as in run_benchmarks: with only a few distinct questions the
+    # answer/result caches would serve every request without reaching the LLM
+    env = dict(
+        os.environ, LLM_PROVIDER="ollama", OLLAMA_BASE_URL=stub_url,
+        ANSWER_CACHE="0", RESULT_CACHE_SIZE="0", QUERY_EMBEDDING_CACHE_SIZE="0"
+    )
+    process = subprocess.Popen(
+        [sys.executable, os.path.join(ROOT_DIR, "src", "api", "serve.py"),
+         "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--threads", str(args.threads)],
+        cwd=ROOT_DIR, env=env
+    )
+    url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup (code {process.returncode})")
+        try:
+            if requests.get(f"{url}/api/health", timeout=1).status_code == 200:
+                return process, stub, url
+        except requests.RequestException:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"Server did not become healthy within {args.startup_timeout}s")
+
+
+def run_load(url, tenant, clients, duration, timeout):
+    latencies, statuses = [], Counter()
+    lock = threading.Lock()
+    stop_at = time.monotonic() + duration
+
+    def client(worker_id):
+        session = requests.Session()
+        i = worker_id
+        while time.monotonic() < stop_at:
+            query = QUERIES[i % len(QUERIES)]
+            i += 1
+            start = time.perf_counter()
+            try:
+                response = session.post(
+                    f"{url}/api/rag/query", json={"query": query},
+                    headers={"X-Tenant-ID": tenant}, timeout=timeout
+                )
+                status = response.status_code
+            except requests.RequestException as e:
+                status = type(e).__name__
+            elapsed = time.perf_counter() - start
+            with lock:
+                statuses[status] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+            if status == 429:
+                # Honour Retry-After loosely so rejected clients do not spin
+                time.sleep(0.1)
+        session.close()
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        list(executor.map(client, range(clients)))
+    wall = time.perf_counter() - start
+
+    report = {
+        "requests": sum(statuses.values()),
+        "requests_per_s": round(sum(statuses.values()) / wall, 2),
+        "statuses": {str(k): v for k, v in sorted(statuses.items(), key=lambda kv: str(kv[0]))},
+    }
+    if latencies:
+        report["latency"] = latency_summary(latencies, wall)
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent load test for /api/rag/query")
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--tenant", default="tenant_123")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--duration", type=float, default=30.0, help="Seconds")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout (s)")
+    parser.add_argument("--spawn-server", action="store_true",
+                        help="Start src/api/serve.py with a stub LLM instead of using --url")
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads", type=int, default=8)
+    parser.add_argument("--llm-latency", type=float, default=0.2, help="Stub LLM delay (s)")
+    parser.add_argument("--startup-timeout", type=float, default=300.0)
+    parser.add_argument("--output", help="Write the JSON report here as well")
+    args = parser.parse_args()
+
+    process, stub, url = None, None, args.url
+    if args.spawn_server:
+        process, stub, url = spawn_server(args)
+    try:
+        print(f"🔥 {args.clients} clients against {url} for {args.duration:.0f}s")
+        report = run_load(url, args.tenant, args.clients, args.duration, args.timeout)
+    finally:
+        if process is not None:
+            process.send_signal(signal.SIGTERM)
+            process.wait(timeout=60)
+            stub.shutdown()
+
+    report.update({
+        "commit": git_commit(),
+        "url": url,
+        "clients": args.clients,
+        "duration_s": args.duration,
+    })
+    if args.spawn_server:
+        report.update({"workers": args.workers, "threads": args.threads, "llm_latency_s": args.llm_latency})
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
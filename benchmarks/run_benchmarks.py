@@ -0,0 +1,470 @@
+"""
+Offline benchmarks for retrieval, ingestion and end-to-end queries.
+
+    python benchmarks/run_benchmarks.py --suite all --output bench.json
+    python benchmarks/run_benchmarks.py --suite search --sizes 1000,10000,100000,1000000
+    python benchmarks/run_benchmarks.py --suite ingest --pages 20,100 --mongo mongodb://localhost:27017/
+
+Every run writes one JSON report (throughput, p50/p95/p99 latency, per-case peak
+RSS and per-stage timings from src.utils.metrics) tagged with the current git commit,
+so reports from two commits can be compared directly.
+
+--mongo mock runs against mongomock (must be installed and support the installed
+pymongo); any other value is a MongoDB URI. Benchmarks use their own database
+(BENCH_DATABASE_NAME, default "rag_benchmark") and never touch tenant data.
+"""
+import os
+import sys
+import gc
+import json
+import time
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+# Ensure project root is in path when run as a script
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(ROOT_DIR)
+
+# Caches and snapshots would measure the second query instead of the search itself
+BENCH_ENV = {
+    "DATABASE_NAME": os.getenv("BENCH_DATABASE_NAME", "rag_benchmark"),
+    "QUERY_EMBEDDING_CACHE_SIZE": "0",
+    "RESULT_CACHE_SIZE": "0",
+    "ANSWER_CACHE": "0",
+    "INDEX_SNAPSHOT_DIR": "",
+    "MODEL_WARMUP": "0",
+}
+
+VOCAB = [
+    "drawer", "insert", "cutlery", "tray", "oak", "walnut", "beech", "grey", "anthracite",
+    "width", "depth", "height", "mm", "cabinet", "wardrobe", "rail", "hinge", "soft-close",
+    "organiser", "divider", "pull-out", "basket", "shelf", "corner", "carcass", "front",
+]
+IMAGE_WORDS = ["diagram", "photo", "drawing", "illustration", "picture"]
+
+
+# ---------------- MEASUREMENT ----------------
+def peak_rss_mb():
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return round(peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024, 1)
+
+
+def current_rss_mb():
+    try:
+        with open("/proc/self/statm") as f:
+            pages = int(f.read().split()[1])
+    except (OSError, ValueError, IndexError):  # not Linux
+        return None
+    return round(pages * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024), 1)
+
+
+class CaseMemory:
+    """
+    Resident memory of one benchmark case. ru_maxrss is a high-water mark for the
+    whole process, so every case would report the largest case run before it;
+    instead the current RSS is sampled every `interval` seconds between start()
+    and stop(). Where the current RSS is unavailable, the process peak is
+    reported only if this case raised it.
+    """
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.start_mb = None
+        self.peak_mb = None
+        self._start_max = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        gc.collect()
+        self.start_mb = current_rss_mb()
+        self._start_max = peak_rss_mb()
+        if self.start_mb is not None:
+            self.peak_mb = self.start_mb
+            self._thread = threading.Thread(target=self._sample, daemon=True)
+            self._thread.start()
+        return self
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+
+    def stop(self):
+        """Returns {"start_rss_mb", "peak_rss_mb"} for the case."""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self.peak_mb = max(self.peak_mb, current_rss_mb())
+        else:
+            end_max = peak_rss_mb()
+            if end_max is not None and end_max > self._start_max:
+                self.peak_mb = end_max
+        return {"start_rss_mb": self.start_mb, "peak_rss_mb": self.peak_mb}
+
+
+def latency_summary(latencies, wall_seconds):
+    ms = np.asarray(latencies) * 1000.0
+    return {
+        "count": len(ms),
+        "throughput_per_s": round(len(ms) / wall_seconds, 2) if wall_seconds else None,
+        "mean_ms": round(float(ms.mean()), 3),
+        "p50_ms": round(float(np.percentile(ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(ms, 95)), 3),
+        "p99_ms": round(float(np.percentile(ms, 99)), 3),
+        "max_ms": round(float(ms.max()), 3),
+    }
+
+
+def stage_deltas(before, after):
+    """Per-stage call count and mean milliseconds between two METRICS snapshots."""
+    stages = {}
+    for stage, (count, total) in after.items():
+        prev_count, prev_total = before.get(stage, (0, 0.0))
+        if count > prev_count:
+            stages[stage] = {
+                "calls": count - prev_count,
+                "mean_ms": round((total - prev_total) * 1000.0 / (count - prev_count), 3),
+            }
+    return stages
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, stderr=subprocess.DEVNULL
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+# ---------------- SYNTHETIC DATA ----------------
+def synthetic_text(rng, words=20):
+    parts = list(rng.choice(VOCAB, words))
+    parts.insert(int(rng.integers(len(parts))), f"ZB-{int(rng.integers(1000, 9999))}")
+    parts.insert(int(rng.integers(len(parts))), f"{int(rng.integers(100, 1200))} mm")
+    return " ".join(parts).capitalize() + "."
+
+
+def synthetic_queries(rng, count, visual=False):
+    queries = []
+    for _ in range(count):
+        query = f"{' '.join(rng.choice(VOCAB, 3))} ZB-{int(rng.integers(1000, 9999))}"
+        if visual:
+            query = f"show {rng.choice(IMAGE_WORDS)} of {query}"
+        queries.append(query)
+    return queries
+
+
+def synthetic_matrix(rng, rows, dim, clusters=256, chunk=100_000):
+    """Clustered, L2-normalized float32 rows, generated in chunks to bound peak memory."""
+    centers = rng.standard_normal((clusters, dim), dtype=np.float32)
+    matrix = np.empty((rows, dim), dtype=np.float32)
+    for start in range(0, rows, chunk):
+        end = min(start + chunk, rows)
+        block = centers[rng.integers(clusters, size=end - start)]
+        block += 0.5 * rng.standard_normal((end - start, dim), dtype=np.float32)
+        block /= np.linalg.norm(block, axis=1, keepdims=True)
+        matrix[start:end] = block
+    return matrix
+
+
+def synthetic_index(collection, rng, tenant_id, doc_type, field, rows, dim, insert_docs):
+    """
+    Builds a TenantIndex of `rows` synthetic records and installs it in INDEX_REGISTRY.
+    With insert_docs the result documents are stored too (without embeddings, as
+    the index is already in memory), so search timings include the top-k fetch.
+    """
+    from bson import ObjectId
+    from src.core.lexical import tokenize
+    from src.core.vector_index import INDEX_REGISTRY, TenantIndex
+
+    matrix = synthetic_matrix(rng, rows, dim)
+    metadata = []
+    token_lists = []
+    batch = []
+    for i in range(rows):
+        doc_id = ObjectId()
+        page_number = i // 10 + 1
+        metadata.append({"_id": doc_id, "source_document": "benchmark.pdf", "page_number": page_number})
+        content = synthetic_text(rng) if doc_type == "text" else f"Image from benchmark.pdf page {page_number}"
+        if doc_type == "text":
+            token_lists.append(tokenize(content))
+        if insert_docs:
+            batch.append({
+                "_id": doc_id, "tenant_id": tenant_id, "type": doc_type, "content": content,
+                "source_document": "benchmark.pdf", "page_number": page_number
+            })
+            if len(batch) >= 10_000:
+                collection.insert_many(batch, ordered=False)
+                batch = []
+    if batch:
+        collection.insert_many(batch, ordered=False)
+
+    index = TenantIndex(tenant_id, doc_type, field, matrix, metadata)
+    if index.lexical is not None:
+        index.lexical.add(token_lists, 0)
+    index.build_ann()
+    INDEX_REGISTRY.put(index)
+    return index
+
+
+def synthetic_pdf(path, pages, rng, image_every=5):
+    """A catalogue-like PDF: dense text on every page, a picture on every `image_every`-th page."""
+    import fitz  # PyMuPDF
+
+    doc = fitz.open()
+    for page_index in range(pages):
+        page = doc.new_page()
+        text = "\n".join(synthetic_text(rng, 12) for _ in range(30))
+        page.insert_textbox(fitz.Rect(36, 36, 560, 800), text, fontsize=8)
+        if image_every and page_index % image_every == 0:
+            pixmap = fitz.Pixmap(fitz.csRGB, fitz.IRect(0, 0, 128, 128), False)
+            pixmap.set_rect(pixmap.irect, tuple(int(c) for c in rng.integers(0, 255, 3)))
+            page.insert_image(fitz.Rect(380, 600, 560, 780), stream=pixmap.tobytes("png"))
+    doc.save(path)
+    doc.close()
+
+
+# ---------------- SUITES ----------------
+def time_calls(fn, inputs, warmup=5):
+    for item in inputs[:warmup]:
+        fn(item)
+    latencies = []
+    start = time.perf_counter()
+    for item in inputs:
+        t0 = time.perf_counter()
+        fn(item)
+        latencies.append(time.perf_counter() - t0)
+    return latencies, time.perf_counter() - start
+
+
+def bench_search(args, collection, rng):
+    from src.core.retriever import Retriever
+    from src.core.vector_index import INDEX_REGISTRY
+    from src.utils.metrics import METRICS
+
+    retriever = Retriever()
+    text_dim = retriever.text_model.get_sentence_embedding_dimension()
+    image_dim = retriever.clip_model.text_projection.shape[1]
+    results = []
+    for size in args.sizes:
+        tenant_id = f"bench_search_{size}"
+        insert_docs = not args.no_fetch and (args.mongo != "mock" or size <= args.mock_max_docs)
+        case = {"rows": size, "documents_fetched": insert_docs}
+        memory = CaseMemory().start()
+        try:
+            t0 = time.perf_counter()
+            text_index = synthetic_index(collection, rng, tenant_id, "text", "embedding_text", size, text_dim, insert_docs)
+            image_rows = max(int(size * args.image_ratio), 1)
+            synthetic_index(collection, rng, tenant_id, "image", "embedding_clip", image_rows, image_dim, insert_docs)
+            case["build_seconds"] = round(time.perf_counter() - t0, 3)
+            case["ann"] = type(text_index.ann).__name__ if text_index.ann is not None else "exact"
+
+            before = METRICS.snapshot()
+            latencies, wall = time_calls(
+                lambda q: retriever.search_text(q, tenant_id=tenant_id), synthetic_queries(rng, args.queries)
+            )
+            case["search_text"] = latency_summary(latencies, wall)
+            latencies, wall = time_calls(
+                lambda q: retriever.search_images(q, tenant_id=tenant_id),
+                synthetic_queries(rng, args.queries, visual=True)
+            )
+            case["search_images"] = dict(latency_summary(latencies, wall), rows=image_rows)
+            case["stages"] = stage_deltas(before, METRICS.snapshot())
+        except Exception as e:
+            case["error"] = repr(e)
+        finally:
+            INDEX_REGISTRY.invalidate(tenant_id)
+            collection.delete_many({"tenant_id": tenant_id})
+            gc.collect()
+        case.update(memory.stop())
+        print(f"🔎 search | {size} rows | {json.dumps(case.get('search_text', case.get('error')))}")
+        results.append(case)
+    retriever.close()
+    return results
+
+
+def reset_ingest_state(collection, pipeline):
+    """
+    Drops everything an ingest case leaves behind besides its records: page
+    hashes, checkpoints, the CLIP embedding cache and tenant versions. The CLIP
+    cache is keyed by image hash across tenants, so without this a later case
+    (or run) would measure cache hits instead of embedding work.
+    """
+    from src.utils.db_helpers import VERSION_COLLECTION_NAME
+
+    db = collection.database
+    for name in (pipeline.page_collection_name, pipeline.checkpoint_collection_name,
+                 pipeline.clip_cache_collection_name, VERSION_COLLECTION_NAME):
+        db.drop_collection(name)
+
+
+def bench_ingest(args, collection, rng):
+    from src.core.ingestor import IngestionPipeline
+    from src.utils.metrics import METRICS
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix="rag-bench-") as work_dir:
+        for pages in args.pages:
+            tenant_id = f"bench_ingest_{pages}"
+            pdf_path = os.path.join(work_dir, f"catalogue_{pages}p.pdf")
+            synthetic_pdf(pdf_path, pages, rng)
+            pipeline = IngestionPipeline(batch_size=args.batch_size, workers=args.workers, flush_size=args.flush_size)
+            pipeline.image_dir = os.path.join(work_dir, "images")
+            case = {"pages": pages, "workers": args.workers, "batch_size": args.batch_size}
+            collection.delete_many({"tenant_id": tenant_id})
+            reset_ingest_state(collection, pipeline)
+            memory = CaseMemory().start()
+            try:
+                before = METRICS.snapshot()
+                t0 = time.perf_counter()
+                pipeline.run(pdf_path, tenant_id, full=True)
+                seconds = time.perf_counter() - t0
+                records = collection.count_documents({"tenant_id": tenant_id})
+                case.update({
+                    "seconds": round(seconds, 3),
+                    "records": records,
+                    "pages_per_s": round(pages / seconds, 2),
+                    "records_per_s": round(records / seconds, 2),
+                    "stages": stage_deltas(before, METRICS.snapshot()),
+                })
+                # Re-ingesting an unchanged file only re-hashes pages
+                t0 = time.perf_counter()
+                pipeline.run(pdf_path, tenant_id)
+                case["unchanged_rerun_seconds"] = round(time.perf_counter() - t0, 3)
+            except Exception as e:
+                case["error"] = repr(e)
+            finally:
+                collection.delete_many({"tenant_id": tenant_id})
+                reset_ingest_state(collection, pipeline)
+            case.update(memory.stop())
+            print(f"📥 ingest | {pages} pages | {case.get('pages_per_s', case.get('error'))} pages/s")
+            results.append(case)
+    return results
+
+
+def bench_e2e(args, collection, rng):
+    from src.utils.llm_stub import serve_in_thread
+
+    # The LLM is a local stand-in server with a fixed latency; LLMNode still goes over HTTP
+    server, base_url = serve_in_thread(latency=args.llm_latency)
+    os.environ["LLM_PROVIDER"] = "ollama"
+    import src.core.pipeline as pipeline_module
+    pipeline_module.OLLAMA_BASE_URL = base_url
+
+    from src.core.vector_index import INDEX_REGISTRY
+    from src.utils.metrics import METRICS
+
+    rag = pipeline_module.RAGPipeline()
+    tenant_id = "bench_e2e"
+    case = {"rows": args.e2e_rows, "llm_latency_s": args.llm_latency, "concurrency": args.concurrency}
+    memory = CaseMemory().start()
+    try:
+        text_dim = rag.retriever.text_model.get_sentence_embedding_dimension()
+        synthetic_index(collection, rng, tenant_id, "text", "embedding_text", args.e2e_rows, text_dim, True)
+        queries = synthetic_queries(rng, args.queries)
+        for query in queries[:3]:
+            rag.run(query, tenant_id)
+
+        def timed(query):
+            t0 = time.perf_counter()
+            rag.run(query, tenant_id)
+            return time.perf_counter() - t0
+
+        before = METRICS.snapshot()
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+            latencies = list(pool.map(timed, queries))
+        case["run"] = latency_summary(latencies, time.perf_counter() - start)
+        case["stages"] = stage_deltas(before, METRICS.snapshot())
+        case["llm_connections"] = server.stats["connections"]
+    except Exception as e:
+        case["error"] = repr(e)
+    finally:
+        INDEX_REGISTRY.invalidate(tenant_id)
+        collection.delete_many({"tenant_id": tenant_id})
+        rag.close()
+        server.shutdown()
+    case.update(memory.stop())
+    print(f"🧪 e2e | {json.dumps(case.get('run', case.get('error')))}")
+    return case
+
+
+# ---------------- MAIN ----------------
+def main():
+    parser = argparse.ArgumentParser(description="Offline retrieval / ingestion / end-to-end benchmarks")
+    parser.add_argument("--suite", choices=["search", "ingest", "e2e", "all"], default="all")
+    parser.add_argument("--sizes", default="1000,10000,100000,1000000", help="Text chunks per tenant for the search suite")
+    parser.add_argument("--image-ratio", type=float, default=0.1, help="Image rows per text row in the search suite")
+    parser.add_argument("--queries", type=int, default=200, help="Timed queries per case")
+    parser.add_argument("--pages", default="10,50", help="Synthetic PDF sizes for the ingest suite")
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--flush-size", type=int, default=500)
+    parser.add_argument("--e2e-rows", type=int, default=10000)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--llm-latency", type=float, default=0.3, help="Seconds the stub LLM takes per answer")
+    parser.add_argument("--mongo", default="mock", help='"mock" (mongomock) or a MongoDB URI')
+    parser.add_argument("--mock-max-docs", type=int, default=20000,
+                        help="With mongomock, larger search cases skip storing documents (its _id lookups scan)")
+    parser.add_argument("--no-fetch", action="store_true", help="Never store result documents in the search suite")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default="benchmark_results.json")
+    args = parser.parse_args()
+    args.sizes = [int(s) for s in args.sizes.split(",") if s]
+    args.pages = [int(p) for p in args.pages.split(",") if p]
+
+    os.environ.update(BENCH_ENV)
+    import pymongo
+    if args.mongo == "mock":
+        import mongomock
+        mock_client = mongomock.MongoClient()
+        # Every MongoClient in the app (retriever, ingestion, helpers) shares the stand-in
+        pymongo.MongoClient = lambda *a, **k: mock_client
+    else:
+        os.environ["MONGODB_URI"] = args.mongo
+
+    from src.utils.db_helpers import get_collection
+    collection, client = get_collection()
+    rng = np.random.default_rng(args.seed)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "mongo": "mongomock" if args.mongo == "mock" else "mongodb",
+            "ann_backend": os.getenv("ANN_BACKEND", "exact"),
+            "embedding_storage": os.getenv("EMBEDDING_STORAGE", "float16"),
+            "args": {k: v for k, v in vars(args).items() if k != "mongo"},
+        }
+    }
+    if args.suite in ("search", "all"):
+        report["search"] = bench_search(args, collection, rng)
+    if args.suite in ("ingest", "all"):
+        report["ingest"] = bench_ingest(args, collection, rng)
+    if args.suite in ("e2e", "all"):
+        report["e2e"] = bench_e2e(args, collection, rng)
+    report["meta"]["peak_rss_mb"] = peak_rss_mb()
+    client.close()
+
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"📊 Report written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
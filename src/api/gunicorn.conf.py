@@ -0,0 +1,51 @@
+# Gunicorn settings for the production API (used by src/api/serve.py):
+#   gunicorn -c src/api/gunicorn.conf.py src.api.server:app
+#
+# The app and the query models are loaded once in the master process and shared
+# copy-on-write by the forked workers. Every worker then opens its own MongoDB
+# client, retrieval thread pool and LLM sessions (none of them survive a fork).
+import os
+import multiprocessing
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Read by src/api/server.py at import time
+os.environ["RAG_DEFER_INIT"] = "1"
+
+bind = os.getenv("WEB_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("WEB_WORKERS", str(min(4, multiprocessing.cpu_count()))))
+# Threads per worker; requests mostly wait on the LLM, so a worker serves several at once.
+# Set via WEB_THREADS (not --threads) so the app's MAX_CONCURRENT_QUERIES follows it.
+worker_class = "gthread"
+threads = int(os.getenv("WEB_THREADS", "8"))
+preload_app = True
+chdir = PROJECT_ROOT
+pythonpath = PROJECT_ROOT
+
+# Long LLM answers and SSE streams must not trip the worker timeout
+timeout = int(os.getenv("WEB_TIMEOUT", "180"))
+graceful_timeout = int(os.getenv("WEB_GRACEFUL_TIMEOUT", "30"))
+keepalive = 5
+accesslog = "-"
+
+
+def when_ready(server):
+    if os.getenv("MODEL_WARMUP", "1") == "1":
+        # Load weights before forking so workers share them
+        from src.core.models import warm_up
+        warm_up(background=False)
+
+
+def post_fork(server, worker):
+    import torch
+    from src.api import server as api
+
+    # Keep workers x torch threads within the machine's cores
+    torch.set_num_threads(max(1, multiprocessing.cpu_count() // max(workers, 1)))
+    api.init_rag()
+
+
+def worker_exit(server, worker):
+    # In-flight requests have finished (or graceful_timeout expired) by now
+    from src.api import server as api
+    api.shutdown_rag()
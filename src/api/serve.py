@@ -0,0 +1,74 @@
+import os
+import sys
+import signal
+import argparse
+
+# Ensure project root is in path when run as a script
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.append(PROJECT_ROOT)
+
+GUNICORN_CONFIG = os.path.join(PROJECT_ROOT, "src", "api", "gunicorn.conf.py")
+
+
+def serve_gunicorn(args):
+    # Settings travel through the environment into gunicorn.conf.py
+    os.environ["WEB_BIND"] = f"{args.host}:{args.port}"
+    os.environ["WEB_WORKERS"] = str(args.workers)
+    os.environ["WEB_THREADS"] = str(args.threads)
+    os.chdir(PROJECT_ROOT)
+    os.execvp(sys.executable, [
+        sys.executable, "-m", "gunicorn", "-c", GUNICORN_CONFIG, "src.api.server:app"
+    ])
+
+
+def serve_waitress(args):
+    """Single process, many threads (Windows, or where gunicorn is not installed)."""
+    from waitress import serve
+
+    os.environ["RAG_DEFER_INIT"] = "1"
+    # Read by src/api/server.py to size its query limit below the thread count
+    os.environ["WEB_THREADS"] = str(args.threads)
+    from src.api import server as api
+    from src.core.models import MODEL_WARMUP, warm_up
+
+    if MODEL_WARMUP:
+        warm_up(background=False)
+    api.init_rag()
+
+    # SIGTERM -> SystemExit, so the finally block closes connections
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        serve(api.app, host=args.host, port=args.port, threads=args.threads)
+    finally:
+        api.shutdown_rag()
+
+
+def gunicorn_available():
+    if os.name == "nt":
+        return False
+    try:
+        import gunicorn  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Production server for the RAG API")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "5000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WEB_WORKERS", str(min(4, os.cpu_count() or 1)))),
+                        help="Worker processes (gunicorn only)")
+    parser.add_argument("--threads", type=int, default=int(os.getenv("WEB_THREADS", "8")),
+                        help="Request threads per worker")
+    parser.add_argument("--server", choices=["auto", "gunicorn", "waitress"], default="auto")
+    args = parser.parse_args()
+
+    server = args.server
+    if server == "auto":
+        server = "gunicorn" if gunicorn_available() else "waitress"
+    print(f"🚀 Serving RAG API with {server} on {args.host}:{args.port}")
+    if server == "gunicorn":
+        serve_gunicorn(args)
+    else:
+        serve_waitress(args)
@@ -1,14 +1,23 @@
 import os
 import sys
 import json
+import tempfile
+import threading
+from contextlib import nullcontext
+from urllib.parse import quote
 from bson import ObjectId
 
 # Ensure project root is in path
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-from flask import Flask, request, jsonify, send_from_directory
+from flask import Flask, Response, request, jsonify, send_from_directory, stream_with_context
 from flask_cors import CORS
-from src.core.pipeline import RAGPipeline
+from werkzeug.formparser import parse_form_data
+from werkzeug.utils import secure_filename
+from src.core.jobs import IngestionJobManager, JobConflict, JobQueueFull
+from src.core.pipeline import BATCH_LLM_CONCURRENCY, RAGPipeline, RetrievalTimeout
+from src.core.models import MODEL_WARMUP, loaded_models, warm_up
+from src.utils.metrics import METRICS, collect_timings, span
 import traceback
 
 app = Flask(__name__)
@@ -20,6 +29,9 @@ BASE_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__fil
 # Point to actual extraction folder
 IMAGES_DIR = os.path.join(BASE_DIR, "extracted_images")
 DOCS_DIR = os.path.join(BASE_DIR, "data")
+# Uploaded PDFs, one folder per tenant
+UPLOAD_DIR = os.getenv("UPLOAD_DIR", os.path.join(BASE_DIR, "uploads"))
+MAX_UPLOAD_MB = int(os.getenv("MAX_UPLOAD_MB", "200"))
 print(f"DEBUG: IMAGES_DIR set to: {IMAGES_DIR}")
 print(f"DEBUG: DOCS_DIR set to: {DOCS_DIR}")
 
@@ -32,13 +44,68 @@ class JSONEncoder(json.JSONEncoder):
 
 app.json_encoder = JSONEncoder
 
-# Initialize RAG Pipeline
-try:
-    print("Starting RAG Server...")
-    rag = RAGPipeline()
-except Exception as e:
-    print(f"Failed to initialize RAG Pipeline: {e}")
-    rag = None
+# Initialize RAG Pipeline (models load lazily, so this does not block startup).
+# Production servers (src/api/serve.py) set RAG_DEFER_INIT=1, preload the models
+# before forking and call init_rag() in every worker instead.
+DEFER_RAG_INIT = os.getenv("RAG_DEFER_INIT", "0") == "1"
+rag = None
+jobs = None
+
+def init_rag():
+    """Creates this process's RAGPipeline (MongoDB client, thread pool, LLM sessions) and ingestion job manager."""
+    global rag, jobs
+    try:
+        print("Starting RAG Server...")
+        rag = RAGPipeline()
+    except Exception as e:
+        print(f"Failed to initialize RAG Pipeline: {e}")
+        rag = None
+    try:
+        jobs = IngestionJobManager()
+    except Exception as e:
+        print(f"Failed to initialize ingestion jobs: {e}")
+        jobs = None
+    return rag
+
+def shutdown_rag():
+    """Closes the pipeline's MongoDB and HTTP connections (graceful worker exit)."""
+    global rag, jobs
+    if jobs is not None:
+        print("Stopping ingestion jobs...")
+        jobs.close()
+        jobs = None
+    if rag is not None:
+        print("Shutting down RAG Pipeline...")
+        rag.close()
+        rag = None
+
+# __mp_main__: this file re-imported as __main__ of a spawned extraction worker
+if not DEFER_RAG_INIT and __name__ != "__mp_main__":
+    init_rag()
+    if rag and MODEL_WARMUP:
+        # Load query models in the background while health checks are already answered
+        warm_up(background=True)
+
+# Bounded query concurrency per process: a request waits at most QUERY_QUEUE_TIMEOUT
+# seconds for a slot, then gets 429 instead of piling up behind slow LLM calls.
+# The limit must stay below the worker's request threads (WEB_THREADS, set by
+# serve.py) or the server queues requests before they ever reach the semaphore;
+# the spare threads keep health, metrics and job status answering under load.
+WEB_THREADS = int(os.getenv("WEB_THREADS", "8"))
+MAX_CONCURRENT_QUERIES = int(os.getenv("MAX_CONCURRENT_QUERIES", str(max(1, WEB_THREADS - 2))))
+QUERY_QUEUE_TIMEOUT = float(os.getenv("QUERY_QUEUE_TIMEOUT", "0.5"))
+# Questions accepted by one /api/rag/batch request
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "10000"))
+query_slots = threading.BoundedSemaphore(MAX_CONCURRENT_QUERIES)
+rejected_queries = 0
+
+def overloaded():
+    global rejected_queries
+    rejected_queries += 1
+    response = jsonify({"error": "Server is busy, please retry shortly"})
+    response.status_code = 429
+    response.headers["Retry-After"] = "1"
+    return response
 
 def serialize_mongo_doc(doc):
     """Recursively convert ObjectId to str in a document/dict."""
@@ -57,12 +124,35 @@ def root():
         "service": "RAG Backend API",
         "endpoints": {
             "query": "/api/rag/query",
+            "query_stream": "/api/rag/query/stream",
+            "health": "/api/health",
+            "cache_stats": "/api/cache/stats",
+            "metrics": "/api/metrics",
             "login": "/api/auth/login",
             "documents": "/api/documents/list",
             "serve_doc": "/api/documents/serve/<filename>"
         }
     })
 
+@app.route('/api/health')
+def health():
+    return jsonify({
+        "status": "ok" if rag else "degraded",
+        "models_loaded": loaded_models(),
+        "max_concurrent_queries": MAX_CONCURRENT_QUERIES,
+        "rejected_queries": rejected_queries
+    })
+
+@app.route('/api/cache/stats')
+def cache_stats():
+    if not rag:
+        return jsonify({"error": "RAG system not initialized"}), 500
+    return jsonify(rag.cache_stats())
+
+@app.route('/api/metrics')
+def metrics():
+    return Response(METRICS.render(), mimetype="text/plain; version=0.0.4")
+
 # Serve images recursively from the extracted_images folder
 @app.route('/api/images/<path:filename>')
 def serve_image(filename):
@@ -78,9 +168,61 @@ def serve_document(filename):
     # Check "original" folder fallback
     if os.path.exists(os.path.join(DOCS_DIR, "original", filename)):
          return send_from_directory(os.path.join(DOCS_DIR, "original"), filename)
-         
+
+    # Documents uploaded through /api/documents/upload (links carry ?tenant=)
+    tenant_id = request.args.get('tenant') or get_tenant_id()
+    if secure_filename(tenant_id) == tenant_id:
+        tenant_dir = os.path.join(UPLOAD_DIR, tenant_id)
+        if os.path.exists(os.path.join(tenant_dir, filename)):
+            return send_from_directory(tenant_dir, filename)
+
     return jsonify({"error": "File not found"}), 404
 
+def inject_pdf_url(item, host_url):
+    src_doc = item.get("source_document")
+    page_num = item.get("page_number")
+    if src_doc:
+        url = f"{host_url}api/documents/serve/{src_doc}"
+        if item.get("tenant_id"):
+            # Browsers open the link without the X-Tenant-ID header
+            url += f"?tenant={quote(item['tenant_id'])}"
+        if page_num:
+            url += f"#page={page_num}"
+        item["pdf_url"] = url
+
+def inject_source_urls(result, host_url):
+    """Adds image `url` and `pdf_url` deep links to the sources of a result."""
+    # Inject Image URLs & PDF Links
+    if result.get("image_sources"):
+        for img in result["image_sources"]:
+            # DB path: extracted_images\tenant_123\file.jpg
+            raw_path = img.get("image_path", "")
+            
+            # Normalize path separators
+            raw_path = raw_path.replace("\\", "/")
+            
+            # We want the part after "extracted_images/"
+            if "extracted_images/" in raw_path:
+                relative_path = raw_path.split("extracted_images/")[-1]
+                img["url"] = f"{host_url}api/images/{relative_path}"
+            else:
+                img["url"] = f"{host_url}api/images/{os.path.basename(raw_path)}"
+            
+            # Inject PDF URL
+            inject_pdf_url(img, host_url)
+
+    # Inject PDF Links for Text Sources
+    if result.get("text_sources"):
+        for txt in result["text_sources"]:
+            inject_pdf_url(txt, host_url)
+    return result
+
+def get_tenant_id():
+    tenant_id = request.headers.get('X-Tenant-ID', 'tenant_123')
+    if not tenant_id or tenant_id == 'undefined' or tenant_id == 'null':
+        tenant_id = 'tenant_123'
+    return tenant_id
+
 @app.route('/api/rag/query', methods=['POST'])
 def query_rag():
     if not rag:
@@ -88,61 +230,136 @@ def query_rag():
 
     data = request.json
     query_text = data.get('query')
-    tenant_id = request.headers.get('X-Tenant-ID', 'tenant_123')
-    if not tenant_id or tenant_id == 'undefined' or tenant_id == 'null':
-        tenant_id = 'tenant_123'
+    tenant_id = get_tenant_id()
 
     if not query_text:
         return jsonify({"error": "No query provided"}), 400
 
     print(f"Processing query: {query_text} for tenant: {tenant_id}")
-    
+    # Per-stage timings (ms) in the response: {"timings": true} or ?timings=1
+    want_timings = bool(data.get('timings')) or request.args.get('timings') == '1'
+
+    if not query_slots.acquire(timeout=QUERY_QUEUE_TIMEOUT):
+        return overloaded()
     try:
-        result = rag.run(query_text, tenant_id=tenant_id)
-        
-        def inject_pdf_url(item):
-            src_doc = item.get("source_document")
-            page_num = item.get("page_number")
-            if src_doc:
-                url = f"{request.host_url}api/documents/serve/{src_doc}"
-                if page_num:
-                    url += f"#page={page_num}"
-                item["pdf_url"] = url
-        
-        # Inject Image URLs & PDF Links
-        if result.get("image_sources"):
-            for img in result["image_sources"]:
-                # DB path: extracted_images\tenant_123\file.jpg
-                raw_path = img.get("image_path", "")
-                
-                # Normalize path separators
-                raw_path = raw_path.replace("\\", "/")
-                
-                # We want the part after "extracted_images/"
-                if "extracted_images/" in raw_path:
-                    relative_path = raw_path.split("extracted_images/")[-1]
-                    img["url"] = f"{request.host_url}api/images/{relative_path}"
-                else:
-                    img["url"] = f"{request.host_url}api/images/{os.path.basename(raw_path)}"
-                
-                # Inject PDF URL
-                inject_pdf_url(img)
-
-        # Inject PDF Links for Text Sources
-        if result.get("text_sources"):
-            for txt in result["text_sources"]:
-                inject_pdf_url(txt)
-
-        # Manually serialize result to ensure clean JSON
-        clean_result = serialize_mongo_doc(result)
+        with collect_timings() if want_timings else nullcontext() as timings:
+            with span("query.request"):
+                result = rag.run(query_text, tenant_id=tenant_id)
+                with span("query.serialize"):
+                    inject_source_urls(result, request.host_url)
+
+                    # Manually serialize result to ensure clean JSON
+                    clean_result = serialize_mongo_doc(result)
+        if want_timings:
+            clean_result["timings"] = timings
         print(f"DEBUG: Internal result keys: {result.keys()}")
         print(f"DEBUG: Sending response to frontend. Answer length: {len(clean_result.get('answer', ''))}")
         print(f"DEBUG: Sample Answer: {clean_result.get('answer', '')[:50]}...")
         return jsonify(clean_result)
+    except RetrievalTimeout as e:
+        print(f"⚠️ {e}")
+        return jsonify({"error": str(e)}), 504
     except Exception as e:
         print(f"Error processing query: {e}")
         traceback.print_exc()
         return jsonify({"error": str(e)}), 500
+    finally:
+        query_slots.release()
+
+def sse_event(event, data):
+    return f"event: {event}\ndata: {json.dumps(serialize_mongo_doc(data))}\n\n"
+
+@app.route('/api/rag/query/stream', methods=['POST'])
+def query_rag_stream():
+    """
+    Server-Sent Events version of /api/rag/query:
+    `sources` (retrieved sources with links), many `token` events, then `done`
+    with the final answer and citation-filtered sources. Failures arrive as `error`.
+    """
+    if not rag:
+        return jsonify({"error": "RAG system not initialized"}), 500
+
+    data = request.json
+    query_text = data.get('query')
+    tenant_id = get_tenant_id()
+
+    if not query_text:
+        return jsonify({"error": "No query provided"}), 400
+
+    print(f"Streaming query: {query_text} for tenant: {tenant_id}")
+    host_url = request.host_url
+
+    def generate():
+        try:
+            for event, payload in rag.run_stream(query_text, tenant_id=tenant_id):
+                if event in ("sources", "done"):
+                    inject_source_urls(payload, host_url)
+                yield sse_event(event, payload)
+        except Exception as e:
+            print(f"Error streaming query: {e}")
+            traceback.print_exc()
+            yield sse_event("error", {"error": str(e)})
+
+    if not query_slots.acquire(timeout=QUERY_QUEUE_TIMEOUT):
+        return overloaded()
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="text/event-stream",
+        # Disable proxy buffering so tokens reach the browser as they are produced
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    # The slot is held until the stream finishes or the client goes away
+    response.call_on_close(query_slots.release)
+    return response
+
+@app.route('/api/rag/batch', methods=['POST'])
+def query_rag_batch():
+    """
+    Answers a list of questions for one tenant, for evaluation runs and answer
+    cache pre-warming. Body: {"queries": [...], "concurrency": n (optional, at
+    most BATCH_LLM_CONCURRENCY)}. Responds with NDJSON, one line per question
+    in completion order: {"index", "query", "answer", sources...} or {"index", "query", "error"}.
+    """
+    if not rag:
+        return jsonify({"error": "RAG system not initialized"}), 500
+
+    data = request.json or {}
+    queries = data.get('queries')
+    tenant_id = get_tenant_id()
+
+    if not isinstance(queries, list) or not queries or not all(isinstance(q, str) and q for q in queries):
+        return jsonify({"error": "'queries' must be a non-empty list of strings"}), 400
+    if len(queries) > BATCH_MAX_QUERIES:
+        return jsonify({"error": f"At most {BATCH_MAX_QUERIES} queries per batch"}), 400
+    try:
+        concurrency = max(1, min(int(data.get('concurrency', BATCH_LLM_CONCURRENCY)), BATCH_LLM_CONCURRENCY))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'concurrency' must be an integer"}), 400
+
+    print(f"Processing batch of {len(queries)} queries for tenant: {tenant_id}")
+    host_url = request.host_url
+
+    def generate():
+        try:
+            for index, result in rag.run_batch(queries, tenant_id, concurrency=concurrency):
+                inject_source_urls(result, host_url)
+                line = {"index": index, "query": queries[index], **serialize_mongo_doc(result)}
+                yield json.dumps(line) + "\n"
+        except Exception as e:
+            print(f"Error processing batch: {e}")
+            traceback.print_exc()
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    # A batch holds one query slot; its own LLM calls are limited by `concurrency`
+    if not query_slots.acquire(timeout=QUERY_QUEUE_TIMEOUT):
+        return overloaded()
+    response = Response(
+        stream_with_context(generate()),
+        mimetype="application/x-ndjson",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+    response.call_on_close(query_slots.release)
+    return response
 
 @app.route('/api/auth/login', methods=['POST'])
 def login():
@@ -154,6 +371,77 @@ def login():
         "user": {"email": email, "name": "Admin User"}
     })
 
+@app.route('/api/documents/upload', methods=['POST'])
+def upload_document():
+    """Streams an uploaded PDF to disk and queues it for background ingestion (202 + job)."""
+    if not jobs:
+        return jsonify({"error": "Ingestion is not available"}), 503
+    tenant_id = get_tenant_id()
+    # The tenant id becomes a directory name here and in the ingestor's image folder
+    if secure_filename(tenant_id) != tenant_id:
+        return jsonify({"error": "Invalid tenant id"}), 400
+    tenant_dir = os.path.join(UPLOAD_DIR, tenant_id)
+    os.makedirs(tenant_dir, exist_ok=True)
+
+    def stream_factory(total_content_length, content_type, filename, content_length=None):
+        # File parts are written straight to disk instead of being held in memory
+        return tempfile.NamedTemporaryFile("wb+", dir=tenant_dir, prefix=".upload-", suffix=".part", delete=False)
+
+    _, form, files = parse_form_data(
+        request.environ, stream_factory=stream_factory, max_content_length=MAX_UPLOAD_MB * 1024 * 1024
+    )
+    parts = [f for _, f in files.items(multi=True)]
+    try:
+        upload = files.get('file')
+        if upload is None:
+            return jsonify({"error": "No file provided (multipart field 'file')"}), 400
+        file_name = secure_filename(upload.filename or "")
+        upload.stream.seek(0)
+        if not file_name.lower().endswith(".pdf") or upload.stream.read(5) != b"%PDF-":
+            return jsonify({"error": "Only PDF documents can be uploaded"}), 400
+        upload.stream.close()
+
+        file_path = os.path.join(tenant_dir, file_name)
+        # The file is moved into place only once the job is accepted (see submit)
+        job = jobs.submit(
+            file_path, tenant_id, full=form.get('full') == 'true',
+            stage=lambda: os.replace(upload.stream.name, file_path)
+        )
+    except JobConflict as e:
+        return jsonify({"error": str(e)}), 409
+    except JobQueueFull as e:
+        response = jsonify({"error": str(e)})
+        response.status_code = 429
+        response.headers["Retry-After"] = "60"
+        return response
+    finally:
+        for part in parts:
+            part.stream.close()
+            if os.path.exists(part.stream.name):
+                os.remove(part.stream.name)
+
+    response = jsonify(job)
+    response.status_code = 202
+    response.headers["Location"] = f"/api/documents/jobs/{job['job_id']}"
+    return response
+
+@app.route('/api/documents/jobs', methods=['GET'])
+def list_jobs():
+    if not jobs:
+        return jsonify({"error": "Ingestion is not available"}), 503
+    tenant_id = get_tenant_id()
+    return jsonify(jobs.list(tenant_id))
+
+@app.route('/api/documents/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    if not jobs:
+        return jsonify({"error": "Ingestion is not available"}), 503
+    tenant_id = get_tenant_id()
+    job = jobs.get(job_id, tenant_id)
+    if job is None:
+        return jsonify({"error": "Job not found"}), 404
+    return jsonify(job)
+
 @app.route('/api/documents/list', methods=['GET'])
 def list_documents():
     return jsonify([
@@ -168,6 +456,10 @@ if __name__ == '__main__':
     print("Port: 5000")
     print("Endpoints:")
     print("  - POST /api/rag/query")
+    print("  - POST /api/rag/query/stream")
+    print("  - POST /api/rag/batch")
     print("  - POST /api/auth/login")
+    print("  - POST /api/documents/upload")
+    print("  - GET  /api/documents/jobs/<job_id>")
     print("="*50 + "\n")
     app.run(host='0.0.0.0', port=5000, debug=True, use_reloader=False)
@@ -0,0 +1,172 @@
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+from dotenv import load_dotenv
+
+# Ensure project root is in path when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.core.scoring import normalize, top_k_indices
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+ANN_BACKEND = os.getenv("ANN_BACKEND", "exact")       # "exact" or "ivf"
+ANN_MIN_ROWS = int(os.getenv("ANN_MIN_ROWS", "20000"))  # below this, brute force is fast enough
+ANN_NLIST = int(os.getenv("ANN_NLIST", "0"))            # 0 = 4 * sqrt(rows)
+ANN_NPROBE = int(os.getenv("ANN_NPROBE", "16"))
+
+ASSIGN_CHUNK = 8192
+
+
+def _assign(vectors, centroids):
+    """Nearest (highest cosine) centroid for every row, computed in chunks."""
+    assign = np.empty(len(vectors), dtype=np.int64)
+    for start in range(0, len(vectors), ASSIGN_CHUNK):
+        block = vectors[start:start + ASSIGN_CHUNK]
+        assign[start:start + ASSIGN_CHUNK] = np.argmax(block @ centroids.T, axis=1)
+    return assign
+
+
+def _group(assign, nlist):
+    """Returns (order, starts, counts) so that order[starts[c]:starts[c]+counts[c]] are the rows of list c."""
+    order = np.argsort(assign, kind="stable")
+    counts = np.bincount(assign, minlength=nlist)
+    starts = np.concatenate(([0], np.cumsum(counts)[:-1]))
+    return order, starts, counts
+
+
+class IVFIndex:
+    """
+    Inverted-file ANN index over L2-normalized rows of an external matrix.
+    Rows are bucketed by their nearest k-means centroid; a query only scores
+    the rows in the `nprobe` buckets whose centroids are closest to it.
+    Raising nprobe improves recall at the cost of latency.
+    """
+    def __init__(self, centroids, nprobe=ANN_NPROBE):
+        self.centroids = centroids
+        self.nprobe = nprobe
+        self.lists = [np.empty(0, dtype=np.int64) for _ in range(len(centroids))]
+
+    @classmethod
+    def train(cls, matrix, nlist=None, iterations=10, nprobe=ANN_NPROBE, seed=0):
+        n = len(matrix)
+        nlist = min(nlist or ANN_NLIST or max(1, int(4 * np.sqrt(n))), n)
+        rng = np.random.default_rng(seed)
+
+        # Train on a sample; 64 points per centroid is plenty for spherical k-means
+        sample_size = min(n, nlist * 64)
+        sample = matrix[np.sort(rng.choice(n, sample_size, replace=False))] if sample_size < n else matrix
+        centroids = sample[rng.choice(len(sample), nlist, replace=False)].copy()
+
+        for _ in range(iterations):
+            assign = _assign(sample, centroids)
+            order, starts, counts = _group(assign, nlist)
+            filled = counts > 0
+            sums = np.add.reduceat(sample[order], starts[filled], axis=0)
+            norms = np.linalg.norm(sums, axis=1, keepdims=True)
+            norms[norms == 0] = 1.0
+            centroids[filled] = sums / norms
+
+        index = cls(np.ascontiguousarray(centroids, dtype=np.float32), nprobe)
+        index.add(matrix, np.arange(n))
+        return index
+
+    def __len__(self):
+        return sum(len(ids) for ids in self.lists)
+
+    def add(self, vectors, row_ids):
+        """Incrementally files new rows (already appended to the matrix) under their nearest centroid."""
+        if not len(vectors):
+            return
+        row_ids = np.asarray(row_ids, dtype=np.int64)
+        assign = _assign(vectors, self.centroids)
+        order, starts, counts = _group(assign, len(self.centroids))
+        for c in np.flatnonzero(counts):
+            new_ids = row_ids[order[starts[c]:starts[c] + counts[c]]]
+            self.lists[c] = np.concatenate((self.lists[c], new_ids))
+
+    def remap(self, keep):
+        """Drops rows where `keep` is False and renumbers the rest to match the compacted matrix."""
+        new_ids = np.cumsum(keep) - 1
+        self.lists = [new_ids[ids[keep[ids]]] for ids in self.lists]
+
+    def search(self, matrix, query_emb, k, nprobe=None):
+        """Returns (rows, scores) of the approximate top-k rows, best first."""
+        query_emb = normalize(query_emb)
+        probe = top_k_indices(self.centroids @ query_emb, nprobe or self.nprobe)
+        rows = np.concatenate([self.lists[c] for c in probe])
+        scores = matrix[rows] @ query_emb
+        best = top_k_indices(scores, k)
+        return rows[best], scores[best]
+
+
+def build_ann(matrix):
+    """Builds the configured ANN engine for a matrix, or None when exact search should be used."""
+    if ANN_BACKEND != "ivf" or len(matrix) < ANN_MIN_ROWS:
+        return None
+    return IVFIndex.train(matrix)
+
+
+# ---------------- RECALL REPORT ----------------
+def recall_report(matrix, ivf, k=10, nprobes=(1, 2, 4, 8, 16, 32), num_queries=200, noise=0.05, seed=0):
+    """
+    Measures recall@k and mean latency of the IVF index against exact search.
+    Queries are perturbed copies of random rows, so they land near real data.
+    """
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(matrix), min(num_queries, len(matrix)), replace=False)
+    queries = matrix[picks] + rng.normal(0, noise, (len(picks), matrix.shape[1])).astype(np.float32)
+
+    start = time.perf_counter()
+    exact = [set(top_k_indices(matrix @ normalize(q), k).tolist()) for q in queries]
+    exact_ms = (time.perf_counter() - start) * 1000 / len(queries)
+
+    report = []
+    for nprobe in nprobes:
+        hits = 0
+        start = time.perf_counter()
+        for q, truth in zip(queries, exact):
+            rows, _ = ivf.search(matrix, q, k, nprobe)
+            hits += len(truth.intersection(rows.tolist()))
+        ann_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        report.append({
+            "nprobe": nprobe,
+            "recall_at_k": hits / (k * len(queries)),
+            "ann_ms": ann_ms,
+            "exact_ms": exact_ms,
+        })
+    return report
+
+
+if __name__ == "__main__":
+    from src.core.vector_index import TenantIndex
+    from src.utils.db_helpers import get_collection
+
+    parser = argparse.ArgumentParser(description="Recall@k report of the IVF index against exact search")
+    parser.add_argument("--tenant", default="tenant_123", help="Tenant ID")
+    parser.add_argument("--type", choices=["text", "image"], default="text", help="Embedding space to test")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--nlist", type=int, default=None)
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    field = "embedding_text" if args.type == "text" else "embedding_clip"
+    col, client = get_collection()
+    index = TenantIndex.from_collection(col, args.tenant, args.type, field)
+    client.close()
+
+    if len(index) <= args.k:
+        print(f"Not enough {args.type} records for tenant {args.tenant} ({len(index)})")
+        sys.exit(1)
+
+    print(f"Training IVF on {len(index)} x {index.matrix.shape[1]} {field} rows...")
+    ivf = IVFIndex.train(index.matrix, nlist=args.nlist)
+    print(f"nlist={len(ivf.centroids)} | k={args.k}")
+    for row in recall_report(index.matrix, ivf, args.k, args.nprobe, args.queries):
+        print(f"nprobe={row['nprobe']:>4} | recall@{args.k}={row['recall_at_k']:.3f} | "
+              f"ann={row['ann_ms']:.2f} ms | exact={row['exact_ms']:.2f} ms")
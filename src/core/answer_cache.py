@@ -0,0 +1,123 @@
+import os
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.core.lexical import is_visual_query, number_terms
+from src.utils.cache import LRUCache, normalize_query
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+# Set ANSWER_CACHE=0 to always run retrieval and generation
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") == "1"
+# Minimum cosine similarity (MiniLM) between a new query and a cached one to reuse its answer
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", "3600"))  # seconds, 0 = no expiry
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "5000"))
+ANSWER_CACHE_MAX_MB = float(os.getenv("ANSWER_CACHE_MAX_MB", "64"))
+
+
+class SemanticAnswerCache:
+    """
+    Per-tenant cache of final answers (answer text plus sources), looked up by
+    the MiniLM embedding of the query: the most similar cached query of the
+    tenant is reused if its cosine similarity reaches `threshold`, both
+    queries name the same model numbers and figures, and both or neither ask
+    for images. MiniLM scores "drawer insert ZB-1234" and "... ZB-1235" as
+    near-identical, but they are different products; and an answer built
+    without image search has no images to show.
+    Every entry remembers the tenant data version it was built from; once the
+    tenant is re-ingested, all of its entries are dropped on the next lookup.
+    Entries share one LRU with a TTL, an entry cap and a memory cap.
+    """
+    def __init__(self, threshold=ANSWER_CACHE_THRESHOLD, max_entries=ANSWER_CACHE_MAX_ENTRIES,
+                 max_mb=ANSWER_CACHE_MAX_MB, ttl=ANSWER_CACHE_TTL):
+        self.threshold = threshold
+        self.entries = LRUCache(max_entries, int(max_mb * 1024 * 1024), ttl, on_evict=self._forget)
+        self._embeddings = {}  # tenant_id -> {key: normalized query embedding}
+        self._versions = {}  # tenant_id -> data version of its cached answers
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def _forget(self, key):
+        tenant_keys = self._embeddings.get(key[0])
+        if tenant_keys is not None:
+            tenant_keys.pop(key, None)
+
+    def _drop_tenant(self, tenant_id):
+        for key in list(self._embeddings.pop(tenant_id, {})):
+            self.entries.pop(key)
+        if self._versions.pop(tenant_id, None) is not None:
+            self.invalidations += 1
+
+    def lookup(self, tenant_id, query, query_emb, version):
+        """Returns (result, similarity) for the closest matching cached query, or None on a miss."""
+        with self._lock:
+            if self._versions.get(tenant_id, version) != version:
+                self._drop_tenant(tenant_id)
+
+            tenant_keys = self._embeddings.get(tenant_id)
+            if tenant_keys:
+                keys = list(tenant_keys)
+                similarities = np.stack([tenant_keys[k] for k in keys]) @ query_emb
+                numbers = visual = None
+                for best in np.argsort(-similarities):
+                    if similarities[best] < self.threshold:
+                        break
+                    if numbers is None:
+                        numbers = number_terms(normalize_query(query))
+                        visual = is_visual_query(query)
+                    # Keys hold the normalized query text
+                    cached_query = keys[best][1]
+                    if number_terms(cached_query) != numbers or is_visual_query(cached_query) != visual:
+                        continue
+                    # get() refreshes the LRU position and enforces the TTL
+                    entry = self.entries.get(keys[best])
+                    if entry is not None:
+                        self.hits += 1
+                        return entry[1], float(similarities[best])
+
+            self.misses += 1
+            return None
+
+    def store(self, tenant_id, query, query_emb, version, result):
+        with self._lock:
+            cached_version = self._versions.get(tenant_id)
+            if cached_version is not None and version < cached_version:
+                return  # answered from data that has been replaced meanwhile
+            if cached_version != version:
+                self._drop_tenant(tenant_id)
+                self._versions[tenant_id] = version
+
+            key = (tenant_id, normalize_query(query))
+            query_emb = np.asarray(query_emb, dtype=np.float32)
+            self._embeddings.setdefault(tenant_id, {})[key] = query_emb
+            self.entries.put(key, (query_emb, result))
+            if key not in self.entries:
+                self._forget(key)  # larger than the whole memory cap
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self._embeddings.clear()
+            self._versions.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            entry_stats = self.entries.stats()
+            return {
+                "threshold": self.threshold,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+                "entries": entry_stats["entries"],
+                "bytes": entry_stats["bytes"],
+                "evictions": entry_stats["evictions"],
+                "tenants": len(self._embeddings),
+            }
@@ -0,0 +1,181 @@
+import os
+import re
+
+from dotenv import load_dotenv
+
+from src.core.models import get_text_model, loaded_models
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+# Upper bound for the Context section of the prompt (tokens, 0 = unlimited)
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "1500"))
+# Word-trigram Jaccard similarity above which a block counts as a near-duplicate
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# Shortest shared suffix/prefix (characters) for two chunks of a page to be stitched together
+CONTEXT_MIN_OVERLAP = int(os.getenv("CONTEXT_MIN_OVERLAP", "30"))
+# Chunks overlap by 200 characters (chunk_text); search a little further back for slack
+OVERLAP_SEARCH_WINDOW = 400
+
+
+# ---------------- TOKEN COUNTING ----------------
+def count_tokens(text):
+    """
+    Approximate prompt tokens of `text`: the MiniLM WordPiece tokenizer once that
+    model is loaded (it always is after a text search), else ~4/3 tokens per word.
+    """
+    if "text" in loaded_models():
+        return len(get_text_model().tokenizer.encode(text, add_special_tokens=False, verbose=False))
+    return (len(re.findall(r"\w+|[^\w\s]", text)) * 4 + 2) // 3
+
+
+def _truncate_to_tokens(text, max_tokens):
+    # Longest word prefix that fits (binary search over the word count)
+    words = text.split()
+    low, high = 0, len(words)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if count_tokens(" ".join(words[:mid])) <= max_tokens:
+            low = mid
+        else:
+            high = mid - 1
+    return " ".join(words[:low])
+
+
+# ---------------- MERGING / DEDUP ----------------
+def _stitch(first, second):
+    """Returns first + second without their shared overlap, or None if they do not overlap."""
+    if len(second) < CONTEXT_MIN_OVERLAP:
+        return None
+    probe = second[:CONTEXT_MIN_OVERLAP]
+    start = max(0, len(first) - OVERLAP_SEARCH_WINDOW)
+    pos = first.find(probe, start)
+    while pos != -1:
+        tail = first[pos:]
+        if second.startswith(tail):
+            return first + second[len(tail):]
+        pos = first.find(probe, pos + 1)
+    return None
+
+
+def _shingles(text):
+    words = re.findall(r"\w+", text.lower())
+    return {tuple(words[i:i + 3]) for i in range(max(len(words) - 2, 1))}
+
+
+def _similarity(a, b):
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class ContextBuilder:
+    """
+    Turns ranked text chunks into prompt context blocks:
+    overlapping chunks of the same (source_document, page_number) are stitched
+    into one block, near-duplicate blocks are dropped, and blocks are added in
+    score order until the token budget is used up (the first block is truncated
+    rather than dropped). Blocks keep the "[Source: X, Page: Y]" header that
+    citations refer to.
+    """
+    def __init__(self, token_budget=CONTEXT_TOKEN_BUDGET, dedup_threshold=CONTEXT_DEDUP_THRESHOLD):
+        self.token_budget = token_budget
+        self.dedup_threshold = dedup_threshold
+
+    @staticmethod
+    def format_block(source, page, content):
+        return f"[Source: {source}, Page: {page}]\n{content}"
+
+    def _merge_pages(self, text_results):
+        # Blocks per page, best-scored chunk first; each block = [score, text]
+        pages = {}
+        for doc in sorted(text_results, key=lambda d: d.get("score", 0.0), reverse=True):
+            key = (doc.get("source_document", "Unknown"), doc.get("page_number", "?"))
+            content = doc.get("content", "")
+            blocks = pages.setdefault(key, [])
+            for block in blocks:
+                merged = _stitch(block[1], content) or _stitch(content, block[1])
+                if merged is not None:
+                    block[1] = merged
+                    break
+            else:
+                blocks.append([doc.get("score", 0.0), content])
+
+            # A stitched block may now overlap another block of the page
+            changed = True
+            while changed and len(blocks) > 1:
+                changed = False
+                for i in range(len(blocks)):
+                    for j in range(len(blocks)):
+                        if i == j:
+                            continue
+                        merged = _stitch(blocks[i][1], blocks[j][1])
+                        if merged is not None:
+                            blocks[i] = [max(blocks[i][0], blocks[j][0]), merged]
+                            del blocks[j]
+                            changed = True
+                            break
+                    if changed:
+                        break
+
+        return [
+            (score, key, content)
+            for key, blocks in pages.items()
+            for score, content in blocks
+        ]
+
+    def build(self, text_results, reserved_tokens=0):
+        """
+        Returns (context_blocks, stats). `reserved_tokens` of the budget are kept
+        for other context (image descriptions). stats compares the prompt tokens
+        against concatenating every chunk verbatim.
+        """
+        verbatim = [
+            self.format_block(d.get("source_document", "Unknown"), d.get("page_number", "?"), d.get("content", ""))
+            for d in text_results
+        ]
+        tokens_before = sum(count_tokens(block) for block in verbatim)
+
+        kept = []
+        kept_shingles = []
+        duplicates = 0
+        for score, key, content in sorted(self._merge_pages(text_results), key=lambda b: b[0], reverse=True):
+            shingles = _shingles(content)
+            lowered = content.lower()
+            if any(
+                _similarity(shingles, other) >= self.dedup_threshold or lowered in other_text.lower()
+                for other, (_, _, other_text) in zip(kept_shingles, kept)
+            ):
+                duplicates += 1
+                continue
+            kept.append((score, key, content))
+            kept_shingles.append(shingles)
+
+        budget = self.token_budget - reserved_tokens if self.token_budget else None
+        blocks = []
+        used = 0
+        over_budget = 0
+        for score, (source, page), content in kept:
+            block = self.format_block(source, page, content)
+            tokens = count_tokens(block)
+            if budget is not None and used + tokens > budget:
+                if blocks:
+                    over_budget += 1
+                    continue
+                # Never send an empty context: shorten the best block instead
+                header_tokens = count_tokens(self.format_block(source, page, ""))
+                block = self.format_block(source, page, _truncate_to_tokens(content, max(budget - header_tokens, 0)))
+                tokens = count_tokens(block)
+            blocks.append(block)
+            used += tokens
+
+        stats = {
+            "chunks": len(text_results),
+            "blocks": len(blocks),
+            "duplicates_dropped": duplicates,
+            "over_budget_dropped": over_budget,
+            "tokens_before": tokens_before,
+            "tokens_after": used,
+            "tokens_saved": max(tokens_before - used, 0),
+        }
+        return blocks, stats
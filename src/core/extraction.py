@@ -0,0 +1,179 @@
+import os
+import time
+import uuid
+import hashlib
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import fitz  # PyMuPDF
+
+from src.core.lexical import tokenize
+
+# Pages handed to a worker per task; small enough to keep the embedding stage fed
+PAGES_PER_TASK = int(os.getenv("INGEST_PAGES_PER_TASK", "8"))
+
+# Decorative image filters (0 disables): images whose shorter side is below
+# IMAGE_MIN_SIDE pixels, or that appear on more than IMAGE_MAX_PAGES pages
+IMAGE_MIN_SIDE = int(os.getenv("IMAGE_MIN_SIDE", "0"))
+IMAGE_MAX_PAGES = int(os.getenv("IMAGE_MAX_PAGES", "0"))
+
+
+def chunk_text(text, max_len=1000, overlap=200):
+    chunks = []
+    start = 0
+    while start < len(text):
+        chunk = text[start:start + max_len].strip()
+        if len(chunk) > 30:
+            chunks.append(chunk)
+        start += max_len - overlap
+    return chunks
+
+
+def page_count(file_path):
+    with fitz.open(file_path) as doc:
+        return len(doc)
+
+
+def repeated_images(file_path, max_pages=IMAGE_MAX_PAGES):
+    """Xrefs of images placed on more than `max_pages` pages (logos, icons, page furniture)."""
+    if max_pages <= 0:
+        return frozenset()
+    pages_per_xref = {}
+    with fitz.open(file_path) as doc:
+        for page in doc:
+            for xref in {img[0] for img in page.get_images(full=True)}:
+                pages_per_xref[xref] = pages_per_xref.get(xref, 0) + 1
+    return frozenset(xref for xref, count in pages_per_xref.items() if count > max_pages)
+
+
+def extract_page_range(file_path, tenant_id, image_dir, start, end, known_hashes=None,
+                       skip_xrefs=frozenset(), min_side=IMAGE_MIN_SIDE):
+    """
+    Extracts text chunks and images for pages [start, end) into records without embeddings.
+    Opens its own document so it can run inside a worker process.
+    Returns a list of (page_number, page_hash, records, seconds); records is None
+    when the page hash equals known_hashes[page_number], i.e. the page is unchanged,
+    and seconds is the time spent extracting the page (reported by the caller,
+    since this may run in a worker process).
+    Images are stored once per tenant under their content hash; images in
+    `skip_xrefs` or smaller than `min_side` are treated as decorative and skipped.
+    """
+    file_name = os.path.basename(file_path)
+    known_hashes = known_hashes or {}
+    doc = fitz.open(file_path)
+    pages = []
+
+    for page_index in range(start, end):
+        page_start = time.perf_counter()
+        page = doc.load_page(page_index)
+        page_number = page_index + 1
+
+        # Page hash covers the text layer and the bytes of every image on the page
+        text = page.get_text()
+        xrefs = [img[0] for img in page.get_images(full=True)]
+        images = [doc.extract_image(xref) for xref in xrefs]
+        image_hashes = [hashlib.sha256(base_image["image"]).hexdigest() for base_image in images]
+        digest = hashlib.sha256(text.encode("utf-8"))
+        for image_hash in image_hashes:
+            digest.update(image_hash.encode("ascii"))
+        page_hash = digest.hexdigest()
+
+        if known_hashes.get(page_number) == page_hash:
+            pages.append((page_number, page_hash, None, time.perf_counter() - page_start))
+            continue
+
+        records = []
+
+        # Extract Text
+        for chunk in chunk_text(text):
+            records.append({
+                "tenant_id": tenant_id,
+                "type": "text",
+                "content": chunk,
+                "tokens": tokenize(chunk),
+                "page_number": page_number,
+                "page_hash": page_hash,
+                "source_document": file_name
+            })
+
+        # Extract Images
+        for xref, base_image, image_hash in zip(xrefs, images, image_hashes):
+            if xref in skip_xrefs or min(base_image["width"], base_image["height"]) < min_side:
+                continue
+
+            # Content-addressed: repeated images share one file
+            image_path = os.path.join(image_dir, tenant_id, f"{image_hash}.{base_image['ext']}")
+            if not os.path.exists(image_path):
+                # Write then rename, so concurrent writers never expose a partial file.
+                # The uuid keeps writers apart, including threads of one process (server jobs)
+                tmp_path = f"{image_path}.{uuid.uuid4().hex}.tmp"
+                try:
+                    with open(tmp_path, "wb") as f:
+                        f.write(base_image["image"])
+                    os.replace(tmp_path, image_path)
+                except BaseException:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+                    raise
+
+            records.append({
+                "tenant_id": tenant_id,
+                "type": "image",
+                "content": f"Image from {file_name} page {page_number}",
+                "image_path": image_path,
+                "content_hash": image_hash,
+                "page_number": page_number,
+                "page_hash": page_hash,
+                "source_document": file_name
+            })
+
+        pages.append((page_number, page_hash, records, time.perf_counter() - page_start))
+
+    doc.close()
+    return pages
+
+
+def iter_pages(file_path, tenant_id, image_dir, workers=1, pages_per_task=PAGES_PER_TASK,
+               start_page=0, known_hashes=None):
+    """
+    Yields (page_number, page_hash, records, seconds) for every page after `start_page`, in page order.
+    With workers > 1, page ranges are extracted by a process pool while the caller
+    consumes earlier pages; at most 2 * workers ranges are in flight, so a slow
+    consumer applies backpressure instead of letting results pile up in memory.
+    """
+    known_hashes = known_hashes or {}
+    count = page_count(file_path)
+    skip_xrefs = repeated_images(file_path)
+    tasks = [
+        (s, min(s + pages_per_task, count),
+         {p: h for p, h in known_hashes.items() if s < p <= s + pages_per_task}, skip_xrefs)
+        for s in range(start_page, count, pages_per_task)
+    ]
+
+    if workers <= 1:
+        for task in tasks:
+            yield from extract_page_range(file_path, tenant_id, image_dir, *task)
+        return
+
+    # spawn keeps workers free of the parent's torch/CUDA state, but each worker
+    # re-imports the parent's __main__ module. ingestor.py and serve.py import
+    # torch lazily for that reason; a plain `python src/api/server.py` still
+    # pulls it into every worker (its pipeline is not started there, though).
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context) as pool:
+        pending_tasks = iter(tasks)
+        in_flight = deque()
+
+        def submit_next():
+            task = next(pending_tasks, None)
+            if task is not None:
+                in_flight.append(pool.submit(extract_page_range, file_path, tenant_id, image_dir, *task))
+
+        for _ in range(2 * workers):
+            submit_next()
+
+        while in_flight:
+            pages = in_flight.popleft().result()
+            submit_next()
+            yield from pages
@@ -1,128 +1,360 @@
 import os
+import sys
+import hashlib
 import argparse
-import fitz  # PyMuPDF
 import pymongo
-import torch
-import open_clip
 import numpy as np
 from dotenv import load_dotenv
-from PIL import Image
-from sentence_transformers import SentenceTransformer
+
+# Ensure project root is in path when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.core.extraction import chunk_text, iter_pages, page_count
+from src.core.quantization import encode_embedding
+from src.core.vector_index import INDEX_REGISTRY
+from src.utils.db_helpers import bump_tenant_version, ensure_indexes
+from src.utils.metrics import observe, span
 
 load_dotenv()
 
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "32"))
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "1"))
+# Cached CLIP embeddings are only reused for the same model
+CLIP_MODEL_TAG = "ViT-B-32/openai"
+# Records buffered before an insert_many; 0 keeps everything until the end
+INGEST_FLUSH_SIZE = int(os.getenv("INGEST_FLUSH_SIZE", "500"))
+
+
+def _file_fingerprint(file_path, block_size=1 << 20):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(block_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
 class IngestionPipeline:
     """
     Multimodal Ingestion Pipeline for PDF documents.
     Extracts text and images, generates embeddings, and stores them in MongoDB.
     """
-    def __init__(self):
+    def __init__(self, batch_size=EMBED_BATCH_SIZE, workers=INGEST_WORKERS, flush_size=INGEST_FLUSH_SIZE):
         print("🧠 Initializing Ingestion Pipeline...")
         self.mongo_uri = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
         self.db_name = os.getenv("DATABASE_NAME", "GenAi")
         self.collection_name = os.getenv("COLLECTION_NAME", "embeddings_rag")
+        self.checkpoint_collection_name = os.getenv("CHECKPOINT_COLLECTION_NAME", "ingest_checkpoints")
+        self.page_collection_name = os.getenv("PAGE_HASH_COLLECTION_NAME", "ingest_pages")
+        self.clip_cache_collection_name = os.getenv("CLIP_CACHE_COLLECTION_NAME", "clip_embedding_cache")
         self.image_dir = "extracted_images"
-        
-        # Load Models
-        self.device = "cuda" if torch.cuda.is_available() else "cpu"
-        self.text_model = SentenceTransformer("all-MiniLM-L6-v2")
-        self.clip_model, _, self.clip_preprocess = open_clip.create_model_and_transforms(
-            "ViT-B-32", pretrained="openai"
-        )
-        self.clip_model.to(self.device)
-        print(f"✅ Models loaded on {self.device}")
+        self.batch_size = batch_size
+        self.workers = workers
+        self.flush_size = flush_size
+
+    # ---------------- MODELS (shared, loaded on first use) ----------------
+    # torch, PIL and src.core.models are imported here rather than at module level:
+    # extraction workers are spawned and re-import this module when it is __main__,
+    # and they only need fitz.
+    @property
+    def device(self):
+        from src.core.models import DEVICE
+        return DEVICE
+
+    @property
+    def text_model(self):
+        from src.core.models import get_text_model
+        return get_text_model()
+
+    @property
+    def clip_model(self):
+        from src.core.models import get_clip
+        return get_clip()[0]
+
+    @property
+    def clip_preprocess(self):
+        from src.core.models import get_clip
+        return get_clip()[1]
 
     def _chunk_text(self, text, max_len=1000, overlap=200):
-        chunks = []
-        start = 0
-        while start < len(text):
-            chunk = text[start:start + max_len].strip()
-            if len(chunk) > 30:
-                chunks.append(chunk)
-            start += max_len - overlap
-        return chunks
-
-    def _embed_text(self, text):
-        emb = self.text_model.encode(text)
-        return (emb / np.linalg.norm(emb)).tolist()
-
-    def _embed_clip_image(self, image_path):
-        image = self.clip_preprocess(Image.open(image_path)).unsqueeze(0).to(self.device)
+        return chunk_text(text, max_len, overlap)
+
+    def _embed_texts(self, texts):
+        embs = self.text_model.encode(texts, batch_size=self.batch_size)
+        embs = embs / np.linalg.norm(embs, axis=1, keepdims=True)
+        return [encode_embedding(emb) for emb in embs]
+
+    def _embed_clip_images(self, image_paths):
+        import torch
+        from PIL import Image
+
+        images = torch.stack([
+            self.clip_preprocess(Image.open(path)) for path in image_paths
+        ]).to(self.device)
         with torch.no_grad():
-            emb = self.clip_model.encode_image(image)
-            emb = emb / emb.norm(dim=-1, keepdim=True)
-        return emb[0].cpu().tolist()
+            embs = self.clip_model.encode_image(images)
+            embs = embs / embs.norm(dim=-1, keepdim=True)
+        return [encode_embedding(emb) for emb in embs.cpu().numpy()]
+
+    def _embed_pending(self, pending_text, pending_images):
+        """Fills in embeddings for queued records in place, one forward pass per batch."""
+        for start in range(0, len(pending_text), self.batch_size):
+            batch = pending_text[start:start + self.batch_size]
+            with span("ingest.embed_text"):
+                embs = self._embed_texts([r["content"] for r in batch])
+            for record, emb in zip(batch, embs):
+                record["embedding_text"] = emb
+
+        if pending_images:
+            self._embed_images_cached(pending_images)
+
+        pending_text.clear()
+        pending_images.clear()
+
+    def _embed_images_cached(self, records):
+        """
+        Fills embedding_clip for image records, running CLIP only once per content
+        hash. Embeddings are looked up in this run's cache, then in the persistent
+        cache collection, and new ones are written back to it.
+        """
+        unseen = list({r["content_hash"] for r in records} - self._clip_cache.keys())
+        if unseen:
+            for doc in self._clip_cache_collection.find({"_id": {"$in": unseen}, "model": CLIP_MODEL_TAG}):
+                self._clip_cache[doc["_id"]] = doc["embedding"]
+
+        missing = {}
+        for r in records:
+            if r["content_hash"] not in self._clip_cache:
+                missing.setdefault(r["content_hash"], r["image_path"])
 
-    def run(self, file_path, tenant_id):
+        missing = list(missing.items())
+        for start in range(0, len(missing), self.batch_size):
+            batch = missing[start:start + self.batch_size]
+            with span("ingest.embed_image"):
+                embs = self._embed_clip_images([path for _, path in batch])
+            self._clip_cache.update((content_hash, emb) for (content_hash, _), emb in zip(batch, embs))
+            self._clip_cache_collection.bulk_write([
+                pymongo.ReplaceOne(
+                    {"_id": content_hash},
+                    {"model": CLIP_MODEL_TAG, "embedding": emb},
+                    upsert=True
+                )
+                for (content_hash, _), emb in zip(batch, embs)
+            ], ordered=False)
+
+        for r in records:
+            r["embedding_clip"] = self._clip_cache[r["content_hash"]]
+
+    def _flush(self, collection, pages, tenant_id, file_name, records, page_hashes, publish=True, removed=None):
+        """
+        Replaces the records of every page in `page_hashes` with `records` (unordered
+        bulk insert) and records the new page hashes. A page's hash is removed before
+        its records change and written back only after the insert, so a crash in
+        between leaves the page marked as changed for the next run.
+        With publish=True the change is published right away (version bump + patch
+        of this process's index, also dropping rows matching `removed`); otherwise
+        run() publishes once at its end.
+        """
+        if not page_hashes:
+            return 0
+
+        page_filter = {
+            "tenant_id": tenant_id,
+            "source_document": file_name,
+            "page_number": {"$in": list(page_hashes)}
+        }
+        with span("ingest.insert"):
+            pages.delete_many(page_filter)
+            collection.delete_many(page_filter)
+            if records:
+                collection.insert_many(records, ordered=False)
+        pages.bulk_write([
+            pymongo.ReplaceOne(
+                {"_id": f"{tenant_id}:{file_name}:{page_number}"},
+                {
+                    "tenant_id": tenant_id,
+                    "source_document": file_name,
+                    "page_number": page_number,
+                    "page_hash": page_hash
+                },
+                upsert=True
+            )
+            for page_number, page_hash in page_hashes.items()
+        ], ordered=False)
+
+        if publish:
+            # Bump the shared version stamp (seen by retrievers in other processes)
+            # and patch any index this process already holds for the tenant.
+            replaced = set(page_hashes)
+            version = bump_tenant_version(collection.database, tenant_id)
+            INDEX_REGISTRY.apply_replace(
+                tenant_id,
+                lambda d: (
+                    (removed is not None and removed(d))
+                    or (d.get("source_document") == file_name and d.get("page_number") in replaced)
+                ),
+                records,
+                version
+            )
+
+        count = len(records)
+        records.clear()
+        page_hashes.clear()
+        return count
+
+    def run(self, file_path, tenant_id, resume=False, full=False, progress=None):
+        """
+        Ingests a PDF for a tenant. By default only pages whose content hash changed
+        since the last ingest are re-embedded; `full=True` rebuilds every page.
+        `progress(pages_done, total_pages, records_inserted)` is called after every
+        page; an exception raised by it aborts the run (resumable with resume=True).
+        Returns {"pages", "unchanged_pages", "records_inserted"}, or None if the file is missing.
+        """
         if not os.path.exists(file_path):
             print(f"❌ PDF not found: {file_path}")
-            return
+            return None
 
         client = pymongo.MongoClient(self.mongo_uri)
-        collection = client[self.db_name][self.collection_name]
-        file_name = os.path.basename(file_path)
+        try:
+            db = client[self.db_name]
+            collection = db[self.collection_name]
+            checkpoints = db[self.checkpoint_collection_name]
+            pages = db[self.page_collection_name]
+            ensure_indexes(collection)
+            self._clip_cache = {}
+            self._clip_cache_collection = db[self.clip_cache_collection_name]
+            file_name = os.path.basename(file_path)
+            file_filter = {"tenant_id": tenant_id, "source_document": file_name}
+            fingerprint = _file_fingerprint(file_path)
+            checkpoint_id = f"{tenant_id}:{file_name}"
+            total_pages = page_count(file_path)
 
-        print(f"\n🚀 Ingesting: {file_name} | Tenant: {tenant_id}")
+            print(f"\n🚀 Ingesting: {file_name} | Tenant: {tenant_id}")
 
-        # Clean existing data for this file/tenant
-        collection.delete_many({
-            "tenant_id": tenant_id,
-            "source_document": file_name
-        })
+            # A checkpoint means an earlier run flushed data it never published
+            checkpoint = checkpoints.find_one({"_id": checkpoint_id})
+            unpublished = checkpoint is not None
+            if resume and checkpoint and checkpoint.get("fingerprint") == fingerprint:
+                start_page = checkpoint["last_page"]
+                inserted = checkpoint.get("records_inserted", 0)
+                print(f"⏩ Resuming after page {start_page} ({inserted} records already stored)")
+            else:
+                start_page = 0
+                inserted = 0
 
-        doc = fitz.open(file_path)
-        records = []
-        os.makedirs(os.path.join(self.image_dir, tenant_id), exist_ok=True)
+            if full:
+                # Clean existing data for this file/tenant (after the checkpoint when resuming)
+                stale_after = start_page
+                known_hashes = {}
+            else:
+                # Only pages that no longer exist are removed up front
+                stale_after = max(start_page, total_pages)
+                known_hashes = {
+                    p["page_number"]: p["page_hash"]
+                    for p in pages.find(file_filter, {"page_number": 1, "page_hash": 1})
+                }
 
-        for page_index, page in enumerate(doc):
-            page_number = page_index + 1
-            print(f"📄 Processing Page {page_number}...")
+            stale = dict(file_filter, page_number={"$gt": stale_after})
+            pages.delete_many(stale)
+            stale_deleted = collection.delete_many(stale).deleted_count > 0
 
-            # Extract Text
-            text = page.get_text()
-            for chunk in self._chunk_text(text):
-                records.append({
-                    "tenant_id": tenant_id,
-                    "type": "text",
-                    "content": chunk,
-                    "embedding_text": self._embed_text(chunk),
-                    "page_number": page_number,
-                    "source_document": file_name
-                })
+            def is_stale(d):
+                return d.get("source_document") == file_name and d.get("page_number", 0) > stale_after
 
-            # Extract Images
-            for img_index, img in enumerate(page.get_images(full=True)):
-                xref = img[0]
-                base_image = doc.extract_image(xref)
-                ext = base_image["ext"]
-                image_name = f"{file_name}_p{page_number}_{img_index}.{ext}"
-                image_path = os.path.join(self.image_dir, tenant_id, image_name)
+            # Changes are published (tenant version bump) once, at the end of the run,
+            # so an unchanged document leaves every cache and index alone. After an
+            # intermediate flush (this run's or an interrupted one's), readers reload
+            # the tenant once instead of this process patching its index per flush.
+            reload_readers = unpublished
 
-                with open(image_path, "wb") as f:
-                    f.write(base_image["image"])
+            records = []
+            page_hashes = {}
+            unchanged = 0
+            # Records are queued across pages and embedded in batches;
+            # `records` keeps the original page order.
+            pending_text = []
+            pending_images = []
+            os.makedirs(os.path.join(self.image_dir, tenant_id), exist_ok=True)
 
-                records.append({
-                    "tenant_id": tenant_id,
-                    "type": "image",
-                    "content": f"Image from {file_name} page {page_number}",
-                    "image_path": image_path,
-                    "embedding_clip": self._embed_clip_image(image_path),
-                    "page_number": page_number,
-                    "source_document": file_name
-                })
+            # Extraction runs in worker processes when workers > 1 (see iter_pages)
+            page_stream = iter_pages(
+                file_path, tenant_id, self.image_dir, self.workers,
+                start_page=start_page, known_hashes=known_hashes
+            )
+            for page_number, page_hash, page_records, extract_seconds in page_stream:
+                observe("ingest.extract_page", extract_seconds)
+                if page_records is None:
+                    unchanged += 1
+                    if progress:
+                        progress(page_number, total_pages, inserted)
+                    continue
+                print(f"📄 Processing Page {page_number}...")
+
+                page_hashes[page_number] = page_hash
+                for record in page_records:
+                    records.append(record)
+                    if record["type"] == "text":
+                        pending_text.append(record)
+                    else:
+                        pending_images.append(record)
+
+                if len(pending_text) >= self.batch_size or len(pending_images) >= self.batch_size:
+                    self._embed_pending(pending_text, pending_images)
+
+                # Flush only on page boundaries so a checkpoint always covers whole pages
+                if self.flush_size and len(records) >= self.flush_size:
+                    self._embed_pending(pending_text, pending_images)
+                    inserted += self._flush(collection, pages, tenant_id, file_name, records, page_hashes,
+                                            publish=False)
+                    reload_readers = True
+                    checkpoints.replace_one({"_id": checkpoint_id}, {
+                        "tenant_id": tenant_id,
+                        "source_document": file_name,
+                        "fingerprint": fingerprint,
+                        "last_page": page_number,
+                        "records_inserted": inserted
+                    }, upsert=True)
+                    print(f"💾 Flushed through page {page_number} ({inserted} records)")
 
-        if records:
-            collection.insert_many(records)
-            print(f"✅ Successfully inserted {len(records)} records")
+                if progress:
+                    progress(page_number, total_pages, inserted)
 
-        client.close()
-        print("🎬 Ingestion completed.")
+            self._embed_pending(pending_text, pending_images)
+            if reload_readers:
+                inserted += self._flush(collection, pages, tenant_id, file_name, records, page_hashes,
+                                        publish=False)
+                bump_tenant_version(collection.database, tenant_id)
+                INDEX_REGISTRY.invalidate(tenant_id)
+            elif page_hashes:
+                inserted += self._flush(collection, pages, tenant_id, file_name, records, page_hashes,
+                                        removed=is_stale if stale_deleted else None)
+            elif stale_deleted:
+                version = bump_tenant_version(collection.database, tenant_id)
+                INDEX_REGISTRY.apply_delete(tenant_id, is_stale, version)
+            checkpoints.delete_one({"_id": checkpoint_id})
+            if unchanged:
+                print(f"♻️ Skipped {unchanged} unchanged pages")
+            print(f"✅ Successfully inserted {inserted} records")
+            print("🎬 Ingestion completed.")
+            if progress:
+                progress(total_pages, total_pages, inserted)
+            return {"pages": total_pages, "unchanged_pages": unchanged, "records_inserted": inserted}
+        finally:
+            client.close()
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Clean Multimodal RAG Ingestion Pipeline")
     parser.add_argument("file_path", help="Path to the PDF file")
     parser.add_argument("--tenant", default="tenant_123", help="Tenant ID")
+    parser.add_argument("--batch-size", type=int, default=EMBED_BATCH_SIZE, help="Embedding batch size")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS,
+                        help="Page extraction processes (1 = extract in this process)")
+    parser.add_argument("--flush-size", type=int, default=INGEST_FLUSH_SIZE,
+                        help="Records per insert_many (0 = single insert at the end)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted ingest from its last flushed page")
+    parser.add_argument("--full", action="store_true",
+                        help="Re-embed every page instead of only pages whose content changed")
     args = parser.parse_args()
 
-    pipeline = IngestionPipeline()
-    pipeline.run(args.file_path, args.tenant)
+    pipeline = IngestionPipeline(batch_size=args.batch_size, workers=args.workers, flush_size=args.flush_size)
+    pipeline.run(args.file_path, args.tenant, resume=args.resume, full=args.full)
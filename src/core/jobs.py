@@ -0,0 +1,316 @@
+import os
+import time
+import uuid
+import socket
+import threading
+import traceback
+from concurrent.futures import ThreadPoolExecutor
+
+import pymongo
+from pymongo.errors import DuplicateKeyError
+from dotenv import load_dotenv
+
+from src.core.ingestor import IngestionPipeline
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
+DB_NAME = os.getenv("DATABASE_NAME", "GenAi")
+JOB_COLLECTION_NAME = os.getenv("INGEST_JOB_COLLECTION_NAME", "ingest_jobs")
+# Claims shared by all server processes: one per document being ingested, one per running job
+LOCK_COLLECTION_NAME = os.getenv("INGEST_JOB_LOCK_COLLECTION_NAME", "ingest_job_locks")
+# Jobs running at once in a server process; they embed on the same models and
+# CPU cores as live queries, so keep this small
+INGEST_JOB_WORKERS = int(os.getenv("INGEST_JOB_WORKERS", "1"))
+# Running jobs per tenant across all server processes; further uploads wait in the queue
+INGEST_JOBS_PER_TENANT = int(os.getenv("INGEST_JOBS_PER_TENANT", "1"))
+# Waiting jobs per tenant before uploads are refused
+INGEST_JOB_QUEUE_LIMIT = int(os.getenv("INGEST_JOB_QUEUE_LIMIT", "10"))
+# Page extraction processes per job
+INGEST_JOB_EXTRACT_WORKERS = int(os.getenv("INGEST_JOB_EXTRACT_WORKERS", "1"))
+# A running job whose process has not sent a heartbeat for this many seconds is failed
+INGEST_JOB_STALE_AFTER = float(os.getenv("INGEST_JOB_STALE_AFTER", "120"))
+# Minimum seconds between progress writes of a running job
+PROGRESS_INTERVAL = 1.0
+# Seconds between heartbeats / stale-job sweeps, and between checks for queued jobs
+HEARTBEAT_INTERVAL = 10.0
+POLL_INTERVAL = 2.0
+
+# Jobs that hold their document's lock; "staging" = accepted, file being moved into place
+ACTIVE_STATUSES = ["staging", "queued", "running"]
+# Server-side fields left out of status responses
+PRIVATE_FIELDS = {"file_path": 0, "full": 0, "owner": 0, "slot": 0}
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class JobConflict(Exception):
+    pass
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class JobLost(Exception):
+    pass
+
+
+def _public(job):
+    if job is not None:
+        job["job_id"] = job.pop("_id")
+    return job
+
+
+class IngestionJobManager:
+    """
+    Background ingestion for uploaded documents. Jobs run IngestionPipeline on a
+    small thread pool inside the server process, so they reuse its loaded models.
+    The queue lives in MongoDB and is shared by every server process: each one
+    claims queued jobs while it has free workers. Lock documents (unique _id)
+    keep a document to one active job and a tenant to `per_tenant` running
+    jobs across processes. Processes heartbeat their running jobs; a job whose
+    process died is failed by the next sweep and its locks are freed.
+    """
+    def __init__(self, workers=INGEST_JOB_WORKERS, per_tenant=INGEST_JOBS_PER_TENANT,
+                 queue_limit=INGEST_JOB_QUEUE_LIMIT, extract_workers=INGEST_JOB_EXTRACT_WORKERS,
+                 stale_after=INGEST_JOB_STALE_AFTER):
+        self.client = pymongo.MongoClient(MONGO_URI)
+        db = self.client[DB_NAME]
+        self.jobs = db[JOB_COLLECTION_NAME]
+        self.locks = db[LOCK_COLLECTION_NAME]
+        self.jobs.create_index([("tenant_id", 1), ("created_at", -1)], name="tenant_created")
+        self.jobs.create_index([("status", 1), ("created_at", 1)], name="status_created")
+        self.workers = workers
+        self.per_tenant = per_tenant
+        self.queue_limit = queue_limit
+        self.extract_workers = extract_workers
+        self.stale_after = stale_after
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ingest-job")
+        self._lock = threading.Lock()
+        self._running = 0  # jobs running in this process
+        self._closing = False
+        self._wake = threading.Event()
+        self._recover()
+        self._poller = threading.Thread(target=self._poll, name="ingest-job-poller", daemon=True)
+        self._poller.start()
+
+    # ---------------- API ----------------
+    def submit(self, file_path, tenant_id, full=False, stage=None):
+        """
+        Queues `file_path` for ingestion and returns the new job's status.
+        `stage()` puts the file in place (e.g. moves the upload there). It runs only
+        once the document's lock is held, so it never replaces a file a job is reading.
+        Raises JobConflict while the same document is queued or running in any process.
+        """
+        if self._closing:
+            raise RuntimeError("Ingestion job manager is shutting down")
+        waiting = self.jobs.count_documents({"tenant_id": tenant_id, "status": {"$in": ["staging", "queued"]}})
+        if waiting >= self.queue_limit:
+            raise JobQueueFull(f"{waiting} ingestion jobs already waiting for tenant {tenant_id}")
+
+        now = time.time()
+        job = {
+            "_id": uuid.uuid4().hex,
+            "tenant_id": tenant_id,
+            "source_document": os.path.basename(file_path),
+            "file_path": file_path,
+            "full": full,
+            "status": "staging",
+            "owner": self.owner,
+            "slot": None,
+            "pages_done": 0,
+            "total_pages": None,
+            "records_inserted": 0,
+            "error": None,
+            "created_at": now,
+            "started_at": None,
+            "finished_at": None,
+            "updated_at": now,
+            "heartbeat_at": now,
+        }
+        # The job exists before its lock, so a sweep never frees a lock of a job it cannot see
+        self.jobs.insert_one(job)
+        document_lock = f"document:{tenant_id}:{job['source_document']}"
+        if not self._take_lock(document_lock, job["_id"]):
+            self.jobs.delete_one({"_id": job["_id"]})
+            raise JobConflict(f"{job['source_document']} is already being ingested")
+        try:
+            if stage is not None:
+                stage()
+        except Exception:
+            self.jobs.delete_one({"_id": job["_id"]})
+            self.locks.delete_many({"job_id": job["_id"]})
+            raise
+        self._update(job["_id"], status="queued", owner=None)
+        self._wake.set()
+        print(f"📥 Queued ingestion job {job['_id']} for {job['source_document']} (tenant {tenant_id})")
+        return self.get(job["_id"], tenant_id)
+
+    def get(self, job_id, tenant_id):
+        return _public(self.jobs.find_one({"_id": job_id, "tenant_id": tenant_id}, PRIVATE_FIELDS))
+
+    def list(self, tenant_id, limit=50):
+        cursor = self.jobs.find({"tenant_id": tenant_id}, PRIVATE_FIELDS)
+        return [_public(job) for job in cursor.sort("created_at", -1).limit(limit)]
+
+    def close(self):
+        """
+        Stops running jobs at their next page and puts them back in the queue (they
+        resume from their checkpoint in whichever process claims them), then closes
+        MongoDB. Queued jobs stay queued for the other or the next server process.
+        """
+        self._closing = True
+        self._wake.set()
+        self._poller.join()
+        self.executor.shutdown(wait=True)
+        self.client.close()
+
+    # ---------------- LOCKS ----------------
+    def _take_lock(self, key, job_id):
+        try:
+            self.locks.insert_one({"_id": key, "job_id": job_id, "owner": self.owner, "created_at": time.time()})
+            return True
+        except DuplicateKeyError:
+            return False
+
+    def _claim_slot(self, tenant_id, job_id):
+        """Takes one of the tenant's `per_tenant` running slots; returns its key or None."""
+        for i in range(self.per_tenant):
+            key = f"slot:{tenant_id}:{i}"
+            if self._take_lock(key, job_id):
+                return key
+        return None
+
+    def _recover(self):
+        """Fails jobs whose process stopped heartbeating and frees locks no active job holds."""
+        now = time.time()
+        stale = {"status": {"$in": ["staging", "running"]}, "heartbeat_at": {"$lt": now - self.stale_after}}
+        for job in self.jobs.find(stale, {"status": 1, "heartbeat_at": 1}):
+            # Matching the old heartbeat lets only one process report each dead job
+            result = self.jobs.update_one(
+                {"_id": job["_id"], "status": job["status"], "heartbeat_at": job["heartbeat_at"]},
+                {"$set": {
+                    "status": "failed", "finished_at": now, "updated_at": now,
+                    "error": "The server process stopped during ingestion; upload the document again to resume",
+                }}
+            )
+            if result.modified_count:
+                print(f"⚠️ Ingestion job {job['_id']} lost its server process, marked failed")
+        for lock in self.locks.find():
+            job = self.jobs.find_one({"_id": lock["job_id"]}, {"status": 1, "slot": 1})
+            held = job is not None and job["status"] in ACTIVE_STATUSES
+            if held and lock["_id"].startswith("slot:"):
+                # A slot is held while its job runs; a fresh one may be mid-claim (see _dispatch)
+                running = job["status"] == "running" and job["slot"] == lock["_id"]
+                held = running or now - lock["created_at"] < self.stale_after
+            if not held:
+                self.locks.delete_one({"_id": lock["_id"], "job_id": lock["job_id"]})
+
+    # ---------------- WORKERS ----------------
+    def _poll(self):
+        """Heartbeats this process's jobs, sweeps dead ones and claims queued jobs."""
+        last_heartbeat = time.monotonic()
+        while not self._closing:
+            try:
+                if time.monotonic() - last_heartbeat >= HEARTBEAT_INTERVAL:
+                    last_heartbeat = time.monotonic()
+                    self.jobs.update_many(
+                        {"owner": self.owner, "status": {"$in": ["staging", "running"]}},
+                        {"$set": {"heartbeat_at": time.time()}}
+                    )
+                    self._recover()
+                self._dispatch()
+            except Exception as e:
+                print(f"⚠️ Ingestion job poller error: {e}")
+            self._wake.wait(POLL_INTERVAL)
+            self._wake.clear()
+
+    def _dispatch(self):
+        """Starts queued jobs, oldest first, while this process has free workers and their tenant a free slot."""
+        full_tenants = set()
+        while not self._closing and self._running < self.workers:
+            query = {"status": "queued"}
+            if full_tenants:
+                query["tenant_id"] = {"$nin": list(full_tenants)}
+            job = self.jobs.find_one(query, sort=[("created_at", 1)])
+            if job is None:
+                return
+            slot = self._claim_slot(job["tenant_id"], job["_id"])
+            if slot is None:
+                full_tenants.add(job["tenant_id"])
+                continue
+            now = time.time()
+            job = self.jobs.find_one_and_update(
+                {"_id": job["_id"], "status": "queued"},
+                {"$set": {"status": "running", "owner": self.owner, "slot": slot,
+                          "started_at": now, "heartbeat_at": now, "updated_at": now}},
+                return_document=pymongo.ReturnDocument.AFTER
+            )
+            if job is None:
+                # Another process claimed it first
+                self.locks.delete_one({"_id": slot})
+                continue
+            with self._lock:
+                self._running += 1
+            self.executor.submit(self._run, job)
+
+    def _run(self, job):
+        job_id = job["_id"]
+        last_write = 0.0
+        requeued = False
+
+        def progress(pages_done, total_pages, records_inserted):
+            nonlocal last_write
+            if self._closing and pages_done < total_pages:
+                raise JobCancelled()
+            now = time.monotonic()
+            if now - last_write >= PROGRESS_INTERVAL or pages_done >= total_pages:
+                last_write = now
+                result = self.jobs.update_one(
+                    {"_id": job_id, "owner": self.owner, "status": "running"},
+                    {"$set": {"pages_done": pages_done, "total_pages": total_pages,
+                              "records_inserted": records_inserted, "updated_at": time.time()}}
+                )
+                if result.matched_count == 0:
+                    # A sweep took it for dead (missed heartbeats); its locks may be reused already
+                    raise JobLost()
+
+        try:
+            pipeline = IngestionPipeline(workers=self.extract_workers)
+            # resume=True: a job stopped by a shutdown continues where it stopped
+            summary = pipeline.run(job["file_path"], job["tenant_id"], resume=True,
+                                   full=job["full"], progress=progress)
+            if summary is None:
+                raise FileNotFoundError(f"PDF not found: {job['file_path']}")
+            self._finish(job_id, "completed", records_inserted=summary["records_inserted"],
+                         unchanged_pages=summary["unchanged_pages"])
+        except JobCancelled:
+            print(f"⏹️ Ingestion job {job_id} stopped by shutdown, back in the queue")
+            self._update(job_id, status="queued", owner=None, slot=None)
+            requeued = True
+        except JobLost:
+            print(f"⚠️ Ingestion job {job_id} was failed by another process, stopping")
+        except Exception as e:
+            print(f"❌ Ingestion job {job_id} failed: {e}")
+            traceback.print_exc()
+            self._finish(job_id, "failed", error=str(e))
+        finally:
+            if requeued:
+                self.locks.delete_one({"_id": job["slot"], "job_id": job_id})
+            else:
+                self.locks.delete_many({"job_id": job_id})
+            with self._lock:
+                self._running -= 1
+            self._wake.set()
+
+    def _update(self, job_id, **fields):
+        fields["updated_at"] = time.time()
+        self.jobs.update_one({"_id": job_id}, {"$set": fields})
+
+    def _finish(self, job_id, status, **fields):
+        self._update(job_id, status=status, finished_at=time.time(), **fields)
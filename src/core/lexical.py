@@ -0,0 +1,169 @@
+import os
+import re
+from collections import Counter
+
+import numpy as np
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "boost")   # "boost", "bm25" or "rrf"
+KEYWORD_BOOST = float(os.getenv("KEYWORD_BOOST", "0.15"))
+BM25_WEIGHT = float(os.getenv("BM25_WEIGHT", "0.3"))
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+# Words, numbers and compound codes such as "ZB-1234.56" or "H/720"
+TOKEN_RE = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+PART_RE = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    """
+    Lowercased terms of `text`. Compound codes (model numbers, SKUs) are kept
+    whole and also split into their parts, so "ZB-1234" matches both "zb-1234"
+    and "1234".
+    """
+    tokens = []
+    for match in TOKEN_RE.findall(text.lower()):
+        tokens.append(match)
+        if not match.isalnum():
+            tokens.extend(PART_RE.findall(match))
+    return tokens
+
+
+def is_code(token):
+    """Model numbers / SKUs: tokens that mix in digits, e.g. "zb-1234" or "h720"."""
+    return any(c.isdigit() for c in token) and any(c.isalpha() or c in "-./" for c in token)
+
+
+def number_terms(text):
+    """Tokens of `text` that contain a digit: codes (see is_code) and plain numbers such as widths."""
+    return frozenset(t for t in tokenize(text) if any(c.isdigit() for c in t))
+
+
+# Words that make a query ask for images as well (image search runs for it)
+VISUAL_KEYWORDS = ["image", "diagram", "picture", "photo", "illustration", "show", "visual", "look like"]
+
+
+def is_visual_query(query):
+    return any(k in query.lower() for k in VISUAL_KEYWORDS)
+
+
+def keyword_terms(query):
+    """Terms that earn the additive keyword boost: query words longer than 3 characters."""
+    terms = []
+    for word in query.split():
+        if len(word) > 3:
+            tokens = tokenize(word)
+            if tokens:
+                terms.append(tokens[0])
+    return terms
+
+
+class BM25Index:
+    """
+    Inverted index over the text chunks of one tenant. Postings map a term to
+    the matrix rows that contain it (and the term frequency), so a query only
+    touches the posting lists of its own terms.
+    """
+    def __init__(self, k1=BM25_K1, b=BM25_B):
+        self.k1 = k1
+        self.b = b
+        self.postings = {}
+        self.doc_len = np.zeros(0, dtype=np.float32)
+
+    @classmethod
+    def build(cls, token_lists):
+        index = cls()
+        index.add(token_lists, 0)
+        return index
+
+    def __len__(self):
+        return len(self.doc_len)
+
+    def add(self, token_lists, first_row):
+        """Indexes new rows first_row, first_row + 1, ... in the order given."""
+        new_postings = {}
+        lengths = []
+        for offset, tokens in enumerate(token_lists):
+            lengths.append(len(tokens))
+            for term, tf in Counter(tokens).items():
+                rows, tfs = new_postings.setdefault(term, ([], []))
+                rows.append(first_row + offset)
+                tfs.append(tf)
+
+        for term, (rows, tfs) in new_postings.items():
+            rows = np.asarray(rows, dtype=np.int64)
+            tfs = np.asarray(tfs, dtype=np.float32)
+            if term in self.postings:
+                old_rows, old_tfs = self.postings[term]
+                rows = np.concatenate((old_rows, rows))
+                tfs = np.concatenate((old_tfs, tfs))
+            self.postings[term] = (rows, tfs)
+
+        self.doc_len = np.concatenate((self.doc_len, np.asarray(lengths, dtype=np.float32)))
+
+    def remap(self, keep):
+        """Drops rows where `keep` is False and renumbers the rest (mirrors TenantIndex.remove)."""
+        new_ids = np.cumsum(keep) - 1
+        postings = {}
+        for term, (rows, tfs) in self.postings.items():
+            mask = keep[rows]
+            if mask.any():
+                postings[term] = (new_ids[rows[mask]], tfs[mask])
+        self.postings = postings
+        self.doc_len = self.doc_len[keep]
+
+    def rows_with(self, term):
+        entry = self.postings.get(term)
+        return entry[0] if entry is not None else np.empty(0, dtype=np.int64)
+
+    def search(self, query_tokens):
+        """Returns (rows, scores) of every row containing at least one query term, in no particular order."""
+        n = len(self)
+        hits = [(term, self.postings[term]) for term in set(query_tokens) if term in self.postings]
+        if not n or not hits:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+        avg_len = float(self.doc_len.mean()) or 1.0
+        all_rows = []
+        all_scores = []
+        for term, (rows, tfs) in hits:
+            df = len(rows)
+            idf = np.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            norm = self.k1 * (1.0 - self.b + self.b * self.doc_len[rows] / avg_len)
+            all_rows.append(rows)
+            all_scores.append(idf * tfs * (self.k1 + 1.0) / (tfs + norm))
+
+        rows, inverse = np.unique(np.concatenate(all_rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores)).astype(np.float32)
+        return rows, scores
+
+
+# ---------------- FUSION ----------------
+def _ranks(scores):
+    ranks = np.empty(len(scores), dtype=np.float32)
+    ranks[np.argsort(-scores, kind="stable")] = np.arange(1, len(scores) + 1)
+    return ranks
+
+
+def fuse_scores(vec_scores, lex_scores, keyword_hits, method=HYBRID_FUSION):
+    """
+    Combines vector and lexical evidence for the same candidate rows.
+    - boost: cosine + KEYWORD_BOOST per matched query keyword (the original heuristic)
+    - bm25:  cosine + BM25_WEIGHT * BM25 scaled to [0, 1] over the candidates
+    - rrf:   reciprocal rank fusion of the cosine and BM25 rankings
+    """
+    if method == "bm25":
+        top = lex_scores.max() if len(lex_scores) else 0.0
+        return vec_scores + (BM25_WEIGHT * lex_scores / top if top > 0 else 0.0)
+    if method == "rrf":
+        fused = 1.0 / (RRF_K + _ranks(vec_scores))
+        matched = lex_scores > 0
+        lex_ranks = _ranks(np.where(matched, lex_scores, -np.inf))
+        return fused + np.where(matched, 1.0 / (RRF_K + lex_ranks), 0.0).astype(np.float32)
+    return vec_scores + KEYWORD_BOOST * keyword_hits
@@ -0,0 +1,116 @@
+import os
+import threading
+
+import torch
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+TEXT_MODEL_NAME = "all-MiniLM-L6-v2"
+CLIP_MODEL_NAME = "ViT-B-32"
+CLIP_PRETRAINED = "openai"
+RERANK_MODEL_NAME = os.getenv("RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+
+DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+
+# Set MODEL_WARMUP=0 to skip loading query models in the background at server start
+MODEL_WARMUP = os.getenv("MODEL_WARMUP", "1") == "1"
+
+# ---------------- REGISTRY ----------------
+# Every model is loaded once per process, on first use, and shared by
+# Retriever, IngestionPipeline and anything else that asks for it.
+_models = {}
+_locks = {}
+_registry_lock = threading.Lock()
+
+
+def _get_or_load(key, loader):
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _registry_lock:
+        lock = _locks.setdefault(key, threading.Lock())
+    # One lock per model, so loading CLIP never blocks a MiniLM caller
+    with lock:
+        model = _models.get(key)
+        if model is None:
+            print(f"🧠 Loading {key} on {DEVICE}...")
+            model = loader()
+            _models[key] = model
+    return model
+
+
+def _load_text_model():
+    from sentence_transformers import SentenceTransformer
+    return SentenceTransformer(TEXT_MODEL_NAME, device=DEVICE)
+
+
+def _load_clip():
+    import open_clip
+    model, _, preprocess = open_clip.create_model_and_transforms(CLIP_MODEL_NAME, pretrained=CLIP_PRETRAINED)
+    return model.to(DEVICE).eval(), preprocess
+
+
+def _load_clip_text_tower():
+    import open_clip
+    model, _, _ = open_clip.create_model_and_transforms(CLIP_MODEL_NAME, pretrained=CLIP_PRETRAINED)
+    # Queries only call encode_text; dropping the vision tower frees most of the weights
+    model.visual = None
+    return model.to(DEVICE).eval()
+
+
+def _load_cross_encoder():
+    from sentence_transformers import CrossEncoder
+    return CrossEncoder(RERANK_MODEL_NAME, device=DEVICE)
+
+
+def get_text_model():
+    """Shared SentenceTransformer (MiniLM) used for chunks and queries."""
+    return _get_or_load("text", _load_text_model)
+
+
+def get_clip():
+    """Shared full CLIP model and its image preprocessing transform (ingestion)."""
+    model, preprocess = _get_or_load("clip", _load_clip)
+    # A full model serves text queries too; let later callers reuse it
+    _models.setdefault("clip_text", model)
+    return model, preprocess
+
+
+def get_clip_text_encoder():
+    """CLIP model for encode_text only: the full model if already loaded, else the text tower alone."""
+    if "clip" in _models:
+        return _models["clip"][0]
+    return _get_or_load("clip_text", _load_clip_text_tower)
+
+
+def get_clip_tokenizer():
+    import open_clip
+    return _get_or_load("clip_tokenizer", lambda: open_clip.get_tokenizer(CLIP_MODEL_NAME))
+
+
+def get_cross_encoder():
+    """Shared cross-encoder used by the optional rerank stage."""
+    return _get_or_load("cross_encoder", _load_cross_encoder)
+
+
+def loaded_models():
+    return sorted(_models)
+
+
+def warm_up(background=True):
+    """Loads the query-time models (MiniLM, CLIP text tower) ahead of the first request."""
+    def load():
+        get_text_model()
+        get_clip_text_encoder()
+        get_clip_tokenizer()
+        print("✅ Query models warmed up")
+
+    if not background:
+        load()
+        return None
+    thread = threading.Thread(target=load, name="model-warmup", daemon=True)
+    thread.start()
+    return thread
@@ -1,20 +1,135 @@
 import os
+import re
+import json
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, TimeoutError as FutureTimeoutError, wait
 from dotenv import load_dotenv
-from groq import Groq
+from groq import APIConnectionError, APIStatusError, APITimeoutError, Groq
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from src.core.retriever import Retriever
+from src.core.context import ContextBuilder, count_tokens
+from src.core.reranker import Reranker
+from src.core.lexical import is_visual_query
+from src.core.answer_cache import ANSWER_CACHE_ENABLED, SemanticAnswerCache
+from src.utils.metrics import bind, span
 
 load_dotenv()
 
+# Image search runs next to the text search and gets this many seconds
+RETRIEVAL_TIMEOUT = float(os.getenv("RETRIEVAL_TIMEOUT", "10"))
+# Image searches and cross-encoder passes; one per request thread (WEB_THREADS)
+# so concurrent queries never wait for each other's stages
+RETRIEVAL_WORKERS = int(os.getenv("RETRIEVAL_WORKERS", os.getenv("WEB_THREADS", "8")))
+# run_batch: LLM calls in flight, and questions encoded/scored together
+BATCH_LLM_CONCURRENCY = int(os.getenv("BATCH_LLM_CONCURRENCY", "4"))
+BATCH_CHUNK_SIZE = int(os.getenv("BATCH_CHUNK_SIZE", "64"))
+
+# LLM HTTP clients: pooled keep-alive connections, timeouts and bounded retries
+LLM_POOL_SIZE = int(os.getenv("LLM_POOL_SIZE", "16"))
+LLM_CONNECT_TIMEOUT = float(os.getenv("LLM_CONNECT_TIMEOUT", "5"))
+LLM_READ_TIMEOUT = float(os.getenv("LLM_READ_TIMEOUT", "120"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BACKOFF = float(os.getenv("LLM_RETRY_BACKOFF", "0.5"))
+# Answers worth retrying: rate limited or a transient server error
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+GROQ_BASE_URL = os.getenv("GROQ_BASE_URL")  # None = Groq's default endpoint
+
+
+class RetrievalTimeout(Exception):
+    """Retrieval ran out of time before finding anything, so there is no answer to give."""
+
+
+def _groq_retryable(error):
+    # Like Retry(read=0) for requests: connect failures and RETRY_STATUSES, but not a read timeout
+    if isinstance(error, APITimeoutError):
+        import httpx
+        return isinstance(error.__cause__, httpx.ConnectTimeout)
+    if isinstance(error, APIStatusError):
+        return error.status_code in RETRY_STATUSES
+    return isinstance(error, APIConnectionError)
+
 
 # --------------------------------------------------
 # LLM Wrapper
 # --------------------------------------------------
 class LLMNode:
-    def __init__(self, provider="ollama", api_key=None):
+    """
+    Calls the configured LLM provider over long-lived, pooled HTTP connections.
+    One requests.Session (OpenAI, Ollama) or Groq client is reused for every
+    call, so concurrent queries share keep-alive connections instead of paying
+    a TCP/TLS handshake each time.
+    """
+    def __init__(self, provider="ollama", api_key=None, pool_size=LLM_POOL_SIZE,
+                 connect_timeout=LLM_CONNECT_TIMEOUT, read_timeout=LLM_READ_TIMEOUT,
+                 max_retries=LLM_MAX_RETRIES, retry_backoff=LLM_RETRY_BACKOFF):
         self.provider = provider
         self.api_key = api_key
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+        self.openai_url = f"{OPENAI_BASE_URL.rstrip('/')}/chat/completions"
+        self.ollama_url = f"{OLLAMA_BASE_URL.rstrip('/')}/api/generate"
+
+        # Retries cover connection errors and 429/5xx answers, with exponential backoff.
+        # Not read timeouts: the model may still be generating, and a retry would
+        # pay for the whole generation again on top of LLM_READ_TIMEOUT already spent.
+        retry = Retry(
+            total=max_retries,
+            read=0,
+            backoff_factor=retry_backoff,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(["POST"]),
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=pool_size, max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._groq = None
+
+    @property
+    def groq_client(self):
+        if self._groq is None:
+            import httpx
+            http_client = httpx.Client(
+                limits=httpx.Limits(max_connections=self.pool_size, max_keepalive_connections=self.pool_size),
+                timeout=httpx.Timeout(self.timeout[1], connect=self.timeout[0]),
+            )
+            self._groq = Groq(
+                api_key=self.api_key,
+                base_url=GROQ_BASE_URL,
+                # The SDK would also retry timeouts; _groq_create retries like `retry` above
+                max_retries=0,
+                http_client=http_client,
+            )
+        return self._groq
+
+    def _groq_create(self, **kwargs):
+        """chat.completions.create with the retry policy of the requests session."""
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self.groq_client.chat.completions.create(**kwargs)
+            except (APIConnectionError, APIStatusError) as e:
+                if attempt == self.max_retries or not _groq_retryable(e):
+                    raise
+                delay = self.retry_backoff * (2 ** attempt)
+                if isinstance(e, APIStatusError):
+                    retry_after = e.response.headers.get("retry-after", "")
+                    if retry_after.replace(".", "", 1).isdigit():
+                        delay = max(delay, float(retry_after))
+                print(f"⚠️ Groq call failed ({e}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def close(self):
+        self.session.close()
+        if self._groq is not None:
+            self._groq.close()
 
     def generate(self, messages, model=None, temperature=0.2):
         if self.provider == "groq":
@@ -27,8 +142,7 @@ class LLMNode:
             return self._call_ollama(prompt, model or "llama2")
 
     def _call_groq(self, messages, model, temperature):
-        client = Groq(api_key=self.api_key)
-        response = client.chat.completions.create(
+        response = self._groq_create(
             model=model,
             messages=messages,
             temperature=temperature,
@@ -36,7 +150,6 @@ class LLMNode:
         return response.choices[0].message.content.strip()
 
     def _call_openai(self, messages, model, temperature):
-        url = "https://api.openai.com/v1/chat/completions"
         headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json",
@@ -46,15 +159,78 @@ class LLMNode:
             "messages": messages,
             "temperature": temperature,
         }
-        res = requests.post(url, headers=headers, json=data)
+        res = self.session.post(self.openai_url, headers=headers, json=data, timeout=self.timeout)
+        res.raise_for_status()
         return res.json()["choices"][0]["message"]["content"].strip()
 
     def _call_ollama(self, prompt, model):
-        url = "http://localhost:11434/api/generate"
         data = {"model": model, "prompt": prompt, "stream": False}
-        res = requests.post(url, json=data)
+        res = self.session.post(self.ollama_url, json=data, timeout=self.timeout)
+        res.raise_for_status()
         return res.json().get("response", "").strip()
 
+    # ---------------- STREAMING ----------------
+    def stream(self, messages, model=None, temperature=0.2):
+        """Same as generate(), but yields the answer as text deltas while it is produced."""
+        if self.provider == "groq":
+            yield from self._stream_groq(messages, model or "llama-3.1-8b-instant", temperature)
+        elif self.provider == "openai":
+            yield from self._stream_openai(messages, model or "gpt-3.5-turbo", temperature)
+        else:
+            prompt = "\n".join([f"{m['role']}: {m['content']}" for m in messages])
+            yield from self._stream_ollama(prompt, model or "llama2")
+
+    def _stream_groq(self, messages, model, temperature):
+        # Only opening the stream is retried; tokens already yielded cannot be taken back
+        response = self._groq_create(
+            model=model,
+            messages=messages,
+            temperature=temperature,
+            stream=True,
+        )
+        for chunk in response:
+            delta = chunk.choices[0].delta.content if chunk.choices else None
+            if delta:
+                yield delta
+
+    def _stream_openai(self, messages, model, temperature):
+        headers = {
+            "Authorization": f"Bearer {self.api_key}",
+            "Content-Type": "application/json",
+        }
+        data = {
+            "model": model,
+            "messages": messages,
+            "temperature": temperature,
+            "stream": True,
+        }
+        with self.session.post(self.openai_url, headers=headers, json=data, stream=True, timeout=self.timeout) as res:
+            res.raise_for_status()
+            # Server-sent events: "data: {json}" lines, terminated by "data: [DONE]"
+            for line in res.iter_lines(decode_unicode=True):
+                if not line or not line.startswith("data:"):
+                    continue
+                payload = line[len("data:"):].strip()
+                if payload == "[DONE]":
+                    break
+                delta = json.loads(payload)["choices"][0]["delta"].get("content")
+                if delta:
+                    yield delta
+
+    def _stream_ollama(self, prompt, model):
+        data = {"model": model, "prompt": prompt, "stream": True}
+        with self.session.post(self.ollama_url, json=data, stream=True, timeout=self.timeout) as res:
+            res.raise_for_status()
+            # One JSON object per line until "done": true
+            for line in res.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                if chunk.get("response"):
+                    yield chunk["response"]
+                if chunk.get("done"):
+                    break
+
 
 # --------------------------------------------------
 # RAG Pipeline (Multi-Tenant + Strict)
@@ -64,6 +240,7 @@ class RAGPipeline:
         print("Initializing RAG Pipeline (Multi-Tenant Production Mode)...")
 
         self.retriever = Retriever()
+        self.executor = ThreadPoolExecutor(max_workers=RETRIEVAL_WORKERS, thread_name_prefix="retrieval")
         self.provider = os.getenv("LLM_PROVIDER", "ollama")
         self.api_key = (
             os.getenv("GROQ_API_KEY")
@@ -72,6 +249,9 @@ class RAGPipeline:
         )
 
         self.llm = LLMNode(provider=self.provider, api_key=self.api_key)
+        self.answer_cache = SemanticAnswerCache() if ANSWER_CACHE_ENABLED else None
+        self.context_builder = ContextBuilder()
+        self.reranker = Reranker(executor=self.executor)
 
     # --------------------------------------------------
     # Query Rewriting
@@ -108,17 +288,74 @@ class RAGPipeline:
     # Visual Intent Detection
     # --------------------------------------------------
     def detect_visual_intent(self, query):
-        keywords = [
-            "image",
-            "diagram",
-            "picture",
-            "photo",
-            "illustration",
-            "show",
-            "visual",
-            "look like"
-        ]
-        return any(k in query.lower() for k in keywords)
+        return is_visual_query(query)
+
+    # --------------------------------------------------
+    # Retrieval Fan-out
+    # --------------------------------------------------
+    def _await_stage(self, future, stage, deadline):
+        try:
+            return future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except FutureTimeoutError:
+            future.cancel()
+            print(f"⚠️ {stage} retrieval timed out after {RETRIEVAL_TIMEOUT}s")
+            return None
+
+    def retrieve(self, query, tenant_id, query_emb=None):
+        """
+        Runs the text search on the calling thread while (for visual queries) the
+        image search, including its CLIP query encoding, runs on the retrieval pool.
+        An image search that exceeds RETRIEVAL_TIMEOUT contributes no results and
+        marks the retrieval partial. Text candidates then go through the optional
+        rerank stage (RERANK).
+        Returns (text_results, image_results, partial).
+        """
+        deadline = time.monotonic() + RETRIEVAL_TIMEOUT
+        with span("query.retrieve"):
+            image_future = None
+            if self.detect_visual_intent(query):
+                # bind() lets the worker thread's spans count towards this request
+                image_future = self.executor.submit(
+                    bind(self.retriever.search_images), query, tenant_id=tenant_id, top_k=3
+                )
+
+            # With reranking enabled, over-fetch candidates and rescore them below
+            text_results = self.retriever.search_text(
+                query, tenant_id=tenant_id, top_k=self.reranker.fetch_k(5), query_emb=query_emb
+            )
+            image_results, partial = [], False
+            if image_future is not None:
+                image_results = self._await_stage(image_future, "Image", deadline)
+                partial = image_results is None
+                image_results = image_results or []
+                print(f"DEBUG: Found {len(image_results)} images for query '{query}'")
+
+        if self.reranker.enabled:
+            with span("query.rerank"):
+                text_results = self.reranker.rerank(query, text_results, 5)
+        return text_results, image_results, partial
+
+    def retrieve_batch(self, queries, tenant_id, query_embs=None):
+        """
+        retrieve() for many queries of one tenant: one batched MiniLM/CLIP encode
+        and one scoring pass per index instead of a search per query.
+        Returns a (text_results, image_results) pair per query.
+        """
+        with span("query.retrieve"):
+            text_results = self.retriever.search_text_batch(
+                queries, tenant_id=tenant_id, top_k=self.reranker.fetch_k(5), query_embs=query_embs
+            )
+            image_results = [[] for _ in queries]
+            visual = [i for i, query in enumerate(queries) if self.detect_visual_intent(query)]
+            if visual:
+                found = self.retriever.search_images_batch([queries[i] for i in visual], tenant_id=tenant_id, top_k=3)
+                for i, images in zip(visual, found):
+                    image_results[i] = images
+
+        if self.reranker.enabled:
+            with span("query.rerank"):
+                text_results = [self.reranker.rerank(q, docs, 5) for q, docs in zip(queries, text_results)]
+        return list(zip(text_results, image_results))
 
     # --------------------------------------------------
     # Main Run
@@ -130,16 +367,193 @@ class RAGPipeline:
         # 0. Query Expansion (Optional/Simple)
         # query = self.rewrite_query(query)
 
-        # 1. Retrieval (Scoped by Tenant)
-        text_results = self.retriever.search_text(query, tenant_id=tenant_id, top_k=5)
-        
-        image_results = []
-        if self.detect_visual_intent(query):
-            image_results = self.retriever.search_images(query, tenant_id=tenant_id, top_k=3)
-            print(f"DEBUG: Found {len(image_results)} images for query '{query}'")
+        # 0.5 Semantic Answer Cache (near-identical question for the same data)
+        query_emb, version, cached = self._cached_answer(query, tenant_id)
+        if cached:
+            return cached
+
+        # 1. Retrieval (Scoped by Tenant, text and images in parallel)
+        text_results, image_results, partial = self.retrieve(query, tenant_id, query_emb)
 
         # 2. Check Retrieval
+        early = self._answer_without_llm(text_results, image_results, partial)
+        if early:
+            return early
+
+        # 3. Build Context / 4. Generate Answer / 5. Filter Sources
+        result = self._generate(query, text_results, image_results)
+        self._finish(query, tenant_id, query_emb, version, result, partial)
+        return result
+
+    def run_stream(self, query, tenant_id):
+        """
+        Streaming variant of run(). Yields (event, data) pairs:
+        "sources" with the retrieved text/image sources as soon as retrieval is done,
+        "token" for every piece of the answer, and a final "done" carrying the same
+        dict run() returns (answer plus citation-filtered sources).
+        """
+        if not tenant_id:
+            yield "done", {"answer": "Error: Tenant ID is missing."}
+            return
+
+        query_emb, version, cached = self._cached_answer(query, tenant_id)
+        if cached:
+            yield "sources", {"text_sources": cached["text_sources"], "image_sources": cached["image_sources"]}
+            yield "token", {"text": cached["answer"]}
+            yield "done", cached
+            return
+
+        text_results, image_results, partial = self.retrieve(query, tenant_id, query_emb)
+        yield "sources", {"text_sources": text_results, "image_sources": image_results}
+
+        early = self._answer_without_llm(text_results, image_results, partial)
+        if early:
+            yield "token", {"text": early["answer"]}
+            yield "done", early
+            return
+
+        with span("query.context_build"):
+            messages, context_stats = self.build_messages(query, text_results, image_results)
+        self._log_context(context_stats)
+        parts = []
+        # Includes the time the client takes to consume each token
+        with span("query.llm"):
+            for delta in self.llm.stream(messages):
+                parts.append(delta)
+                yield "token", {"text": delta}
+
+        answer = "".join(parts).strip()
+        result = {
+            "answer": answer,
+            "text_sources": self.filter_sources(answer, text_results),
+            "image_sources": image_results,
+            "context_stats": context_stats,
+        }
+        self._finish(query, tenant_id, query_emb, version, result, partial)
+        yield "done", result
+
+    def run_batch(self, queries, tenant_id, concurrency=BATCH_LLM_CONCURRENCY, chunk_size=BATCH_CHUNK_SIZE):
+        """
+        Answers many questions for one tenant (evaluation sets, answer cache
+        pre-warming). Yields (position, result) as answers complete, so not in the
+        order of `queries`; a failed question yields {"error": ...}.
+        Questions are encoded, cache-checked and retrieved `chunk_size` at a time
+        while up to `concurrency` LLM calls run. The next chunk is only prepared
+        once the LLM has caught up, so memory stays flat for any batch size.
+        """
+        if not tenant_id:
+            for position in range(len(queries)):
+                yield position, {"answer": "Error: Tenant ID is missing."}
+            return
+
+        pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix="batch-llm")
+        in_flight = {}  # future -> (position, query, query_emb, version)
+        try:
+            for start in range(0, len(queries), chunk_size):
+                chunk = queries[start:start + chunk_size]
+                query_embs = self.retriever.encode_text_queries(chunk)
+
+                version = None
+                todo = list(range(len(chunk)))
+                if self.answer_cache is not None:
+                    with span("query.answer_cache"):
+                        version = self.retriever.indexes.version(self.retriever.collection.database, tenant_id)
+                        hits = [self._lookup_answer(tenant_id, q, emb, version) for q, emb in zip(chunk, query_embs)]
+                    for offset, cached in enumerate(hits):
+                        if cached:
+                            yield start + offset, cached
+                    todo = [offset for offset, cached in enumerate(hits) if not cached]
+                if not todo:
+                    continue
+
+                retrieved = self.retrieve_batch([chunk[o] for o in todo], tenant_id, query_embs[todo])
+                for offset, (text_results, image_results) in zip(todo, retrieved):
+                    early = self._answer_without_llm(text_results, image_results)
+                    if early:
+                        yield start + offset, early
+                        continue
+                    future = pool.submit(self._generate, chunk[offset], text_results, image_results)
+                    in_flight[future] = (start + offset, chunk[offset], query_embs[offset], version)
+
+                # Let the LLM catch up before preparing the next chunk
+                while len(in_flight) > concurrency:
+                    yield from self._collect_batch(in_flight, tenant_id)
+            while in_flight:
+                yield from self._collect_batch(in_flight, tenant_id)
+        finally:
+            # A client that disconnects mid-batch leaves nothing queued behind it
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    def _collect_batch(self, in_flight, tenant_id):
+        """Yields (position, result) for the LLM calls of run_batch that have finished."""
+        done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+        for future in done:
+            position, query, query_emb, version = in_flight.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"❌ Batch question {position} failed: {e}")
+                yield position, {"error": str(e)}
+                continue
+            self._store_answer(query, tenant_id, query_emb, version, result)
+            yield position, result
+
+    # --------------------------------------------------
+    # Answer Cache
+    # --------------------------------------------------
+    def _cached_answer(self, query, tenant_id):
+        """
+        Returns (query_emb, version, cached_result). query_emb and version are None
+        when the cache is disabled; on a miss the embedding is reused for text retrieval.
+        """
+        if self.answer_cache is None:
+            return None, None, None
+        with span("query.answer_cache"):
+            # Read the version before retrieval, so an answer is never newer than its tag
+            version = self.retriever.indexes.version(self.retriever.collection.database, tenant_id)
+            query_emb = self.retriever.encode_text_query(query)
+            cached = self._lookup_answer(tenant_id, query, query_emb, version)
+        return query_emb, version, cached
+
+    def _lookup_answer(self, tenant_id, query, query_emb, version):
+        hit = self.answer_cache.lookup(tenant_id, query, query_emb, version)
+        if hit is None:
+            return None
+        result, similarity = hit
+        print(f"♻️ Answer cache hit for tenant {tenant_id} (similarity {similarity:.3f})")
+        # Callers decorate sources in place (URLs), so hand out copies
+        return {
+            "answer": result["answer"],
+            "text_sources": [dict(doc) for doc in result["text_sources"]],
+            "image_sources": [dict(doc) for doc in result["image_sources"]],
+            "cached": True,
+        }
+
+    def _store_answer(self, query, tenant_id, query_emb, version, result):
+        if self.answer_cache is not None:
+            self.answer_cache.store(tenant_id, query, query_emb, version, result)
+
+    def _finish(self, query, tenant_id, query_emb, version, result, partial):
+        """Flags an answer built without the timed-out image search; only complete answers are cached."""
+        if partial:
+            result["partial"] = True
+        else:
+            self._store_answer(query, tenant_id, query_emb, version, result)
+
+    def cache_stats(self):
+        return {
+            "answer_cache": self.answer_cache.stats() if self.answer_cache else None,
+            **self.retriever.cache_stats(),
+        }
+
+    # --------------------------------------------------
+    # Run Steps
+    # --------------------------------------------------
+    def _answer_without_llm(self, text_results, image_results, partial=False):
         if not text_results and not image_results:
+             if partial:
+                 # Nothing found only because a search was cut short: not a real "no"
+                 raise RetrievalTimeout(f"Image retrieval timed out after {RETRIEVAL_TIMEOUT}s, please retry")
              return {
                 "answer": "This information is not available in the uploaded catalogues.",
                 "text_sources": [],
@@ -153,16 +567,33 @@ class RAGPipeline:
                  "text_sources": [],
                  "image_sources": image_results
              }
+        return None
 
-        # 3. Build Context
-        context_blocks = []
-        for doc in text_results:
-            content = doc.get("content", "")
-            source = doc.get("source_document", "Unknown")
-            page = doc.get("page_number", "?")
-            context_blocks.append(f"[Source: {source}, Page: {page}]\n{content}")
-        
+    def _generate(self, query, text_results, image_results):
+        """Builds the prompt, asks the LLM and keeps the sources the answer cites."""
+        with span("query.context_build"):
+            messages, context_stats = self.build_messages(query, text_results, image_results)
+        self._log_context(context_stats)
+        with span("query.llm"):
+            answer = self.llm.generate(messages)
+
+        return {
+            "answer": answer,
+            "text_sources": self.filter_sources(answer, text_results),
+            "image_sources": image_results,
+            "context_stats": context_stats,
+        }
+
+    def _log_context(self, stats):
+        print(
+            f"🧩 Context: {stats['chunks']} chunks -> {stats['blocks']} blocks | "
+            f"{stats['tokens_before']} -> {stats['tokens_after']} tokens (saved {stats['tokens_saved']})"
+        )
+
+    def build_messages(self, query, text_results, image_results):
+        """Returns (messages, context_stats); see ContextBuilder for how chunks are packed."""
         # Add Image Metadata to Context so LLM knows what images are shown
+        image_context = None
         if image_results:
             image_meta_list = []
             for img in image_results:
@@ -172,11 +603,15 @@ class RAGPipeline:
                 image_meta_list.append(f"[Visual Source: {src}, Page: {pg}] - Description: {desc}")
             
             image_context = "The following images have been retrieved and are displayed to the user:\n" + "\n".join(image_meta_list)
+
+        # Build Context (merged, deduplicated, within the token budget)
+        reserved = count_tokens(image_context) if image_context else 0
+        context_blocks, context_stats = self.context_builder.build(text_results, reserved_tokens=reserved)
+        if image_context:
             context_blocks.append(image_context)
-        
         context_text = "\n\n".join(context_blocks)
 
-        # 4. Generate Answer
+        # Generate Answer
         system_prompt = (
             "You are a production-grade RAG assistant for furniture catalogues.\n"
             "STRICT RULES:\n"
@@ -202,15 +637,13 @@ Answer:
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": user_prompt}
         ]
+        return messages, context_stats
 
-        answer = self.llm.generate(messages)
-
-        # 5. Filter Sources based on Answer
-        # 5. Filter Sources (Modified: Always return relevant chunks for visibility)
+    def filter_sources(self, answer, text_results):
+        # Filter Sources (Modified: Always return relevant chunks for visibility)
         final_text_sources = []
         
         # Check for citations first
-        import re
         citations = re.findall(r'\[(.*?),\s*Page\s*(\d+)\]', answer, re.IGNORECASE)
         
         if citations:
@@ -226,11 +659,9 @@ Answer:
         if not final_text_sources:
             final_text_sources = text_results
 
-        return {
-            "answer": answer,
-            "text_sources": final_text_sources,
-            "image_sources": image_results,
-        }
+        return final_text_sources
 
     def close(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+        self.llm.close()
         self.retriever.close()
\ No newline at end of file
@@ -0,0 +1,109 @@
+import os
+import sys
+import struct
+import argparse
+
+import numpy as np
+from bson.binary import Binary
+from dotenv import load_dotenv
+
+# Ensure project root is in path when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+from src.core.scoring import top_k_indices
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+# How IngestionPipeline stores embedding_text / embedding_clip:
+#   "float"   - BSON array of doubles (original format, ~9+ bytes per dimension)
+#   "float16" - packed half precision Binary (2 bytes per dimension)
+#   "int8"    - scalar-quantized Binary with a float32 scale (1 byte per dimension)
+EMBEDDING_STORAGE = os.getenv("EMBEDDING_STORAGE", "float16")
+
+# First byte of every packed blob identifies its layout
+TAG_FLOAT16 = 1
+TAG_INT8 = 2
+
+
+def encode_embedding(vec, fmt=EMBEDDING_STORAGE):
+    """Converts an embedding into its MongoDB storage form."""
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    if fmt == "float16":
+        return Binary(bytes([TAG_FLOAT16]) + vec.astype("<f2").tobytes())
+    if fmt == "int8":
+        scale = float(np.abs(vec).max()) / 127.0 or 1.0
+        quantized = np.clip(np.rint(vec / scale), -127, 127).astype(np.int8)
+        return Binary(bytes([TAG_INT8]) + struct.pack("<f", scale) + quantized.tobytes())
+    return vec.tolist()
+
+
+def decode_embedding(value):
+    """Stored embedding (list or packed blob) -> float32 NumPy array, without per-element Python objects."""
+    if isinstance(value, (bytes, bytearray)):
+        tag = value[0]
+        if tag == TAG_FLOAT16:
+            return np.frombuffer(value, dtype="<f2", offset=1).astype(np.float32)
+        if tag == TAG_INT8:
+            scale = struct.unpack_from("<f", value, 1)[0]
+            return np.frombuffer(value, dtype=np.int8, offset=5).astype(np.float32) * scale
+        raise ValueError(f"Unknown embedding blob tag: {tag}")
+    return np.asarray(value, dtype=np.float32)
+
+
+def decode_matrix(values):
+    """Stacks stored embeddings into one (n, dim) float32 matrix."""
+    if not values:
+        return np.zeros((0, 0), dtype=np.float32)
+    return np.stack([decode_embedding(v) for v in values])
+
+
+def stored_size(value):
+    return len(value) if isinstance(value, (bytes, bytearray)) else 8 * len(value)
+
+
+# ---------------- RECALL CHECK ----------------
+def recall_check(matrix, fmt, k=10, num_queries=200, seed=0):
+    """
+    Recall@k of exact search over the round-tripped `fmt` matrix against the
+    float32 matrix, using perturbed rows as queries. Rows must be L2-normalized.
+    """
+    rng = np.random.default_rng(seed)
+    decoded = decode_matrix([encode_embedding(row, fmt) for row in matrix])
+    decoded /= np.linalg.norm(decoded, axis=1, keepdims=True)
+
+    picks = rng.choice(len(matrix), min(num_queries, len(matrix)), replace=False)
+    queries = matrix[picks] + rng.normal(0, 0.05, (len(picks), matrix.shape[1])).astype(np.float32)
+
+    hits = 0
+    for q in queries:
+        truth = set(top_k_indices(matrix @ q, k).tolist())
+        hits += len(truth.intersection(top_k_indices(decoded @ q, k).tolist()))
+    return hits / (k * len(queries))
+
+
+if __name__ == "__main__":
+    from src.core.vector_index import TenantIndex
+    from src.utils.db_helpers import get_collection
+
+    parser = argparse.ArgumentParser(description="Recall@k and size of quantized embedding storage")
+    parser.add_argument("--tenant", default="tenant_123", help="Tenant ID")
+    parser.add_argument("--type", choices=["text", "image"], default="text", help="Embedding space to test")
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200)
+    args = parser.parse_args()
+
+    field = "embedding_text" if args.type == "text" else "embedding_clip"
+    col, client = get_collection()
+    index = TenantIndex.from_collection(col, args.tenant, args.type, field)
+    client.close()
+
+    if len(index) <= args.k:
+        print(f"Not enough {args.type} records for tenant {args.tenant} ({len(index)})")
+        sys.exit(1)
+
+    print(f"{len(index)} x {index.matrix.shape[1]} {field} rows")
+    for fmt in ("float", "float16", "int8"):
+        size = stored_size(encode_embedding(index.matrix[0], fmt))
+        recall = recall_check(index.matrix, fmt, args.k, args.queries)
+        print(f"{fmt:>8} | {size:>5} bytes/vector | recall@{args.k}={recall:.3f}")
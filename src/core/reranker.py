@@ -0,0 +1,130 @@
+import os
+import time
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.core.lexical import is_code, tokenize
+from src.core.models import get_cross_encoder, loaded_models
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+# "off", "lexical" (term coverage + exact SKU matches) or "cross-encoder" (RERANK_MODEL)
+RERANK = os.getenv("RERANK", "off")
+# Candidates fetched from the retriever before reranking down to the final top-k
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "50"))
+# Past this, the original retrieval order is used
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "150"))
+# Skip reranking when the gap between the k-th and (k+1)-th retrieval score is at
+# least this share of the candidates' score range (the top-k is already clear)
+RERANK_MARGIN = float(os.getenv("RERANK_MARGIN", "0.3"))
+
+# Lexical scorer weights, added to the min-max normalized retrieval score
+COVERAGE_WEIGHT = 0.5
+SKU_WEIGHT = 1.0
+
+
+def _min_max(scores):
+    spread = scores.max() - scores.min()
+    return (scores - scores.min()) / spread if spread > 0 else np.zeros_like(scores)
+
+
+class Reranker:
+    """
+    Optional second stage between retrieval and generation: rescores an
+    over-fetched candidate list and keeps the best top_k. Leaves the order alone
+    when the retrieval top-k is already clearly separated, when the cross-encoder
+    is still loading, or when scoring exceeds the latency budget.
+    """
+    def __init__(self, method=RERANK, candidates=RERANK_CANDIDATES, budget_ms=RERANK_BUDGET_MS,
+                 margin=RERANK_MARGIN, executor=None):
+        self.method = method
+        self.candidates = candidates
+        self.budget = budget_ms / 1000.0
+        self.margin = margin
+        self.executor = executor  # runs cross-encoder passes so they can be abandoned
+        self._loading = None
+        self.stats = {"reranked": 0, "early_exits": 0, "timeouts": 0, "not_ready": 0}
+
+    @property
+    def enabled(self):
+        return self.method in ("lexical", "cross-encoder")
+
+    def fetch_k(self, top_k):
+        """How many candidates to retrieve for a final `top_k`."""
+        return max(top_k, self.candidates) if self.enabled else top_k
+
+    def rerank(self, query, docs, top_k):
+        if not self.enabled or len(docs) <= top_k:
+            return docs[:top_k]
+
+        first_stage = np.array([d.get("score", 0.0) for d in docs], dtype=np.float32)
+        ranked = np.sort(first_stage)[::-1]
+        spread = ranked[0] - ranked[-1]
+        if spread > 0 and (ranked[top_k - 1] - ranked[top_k]) / spread >= self.margin:
+            self.stats["early_exits"] += 1
+            return docs[:top_k]
+
+        start = time.monotonic()
+        if self.method == "cross-encoder":
+            scores = self._cross_encoder_scores(query, docs)
+        else:
+            scores = self._lexical_scores(query, docs, first_stage)
+        if scores is None or time.monotonic() - start > self.budget:
+            if scores is not None:
+                self.stats["timeouts"] += 1
+            return docs[:top_k]
+
+        self.stats["reranked"] += 1
+        order = np.argsort(-scores, kind="stable")[:top_k]
+        results = []
+        for i in order:
+            docs[i]["rerank_score"] = float(scores[i])
+            results.append(docs[i])
+        return results
+
+    # ---------------- SCORERS ----------------
+    def _lexical_scores(self, query, docs, first_stage):
+        """Retrieval score + share of query terms present + exact model-number matches."""
+        query_terms = set(tokenize(query))
+        codes = {t for t in query_terms if is_code(t)}
+        coverage = np.zeros(len(docs), dtype=np.float32)
+        sku_hits = np.zeros(len(docs), dtype=np.float32)
+        for i, doc in enumerate(docs):
+            terms = set(tokenize(doc.get("content", "")))
+            if query_terms:
+                coverage[i] = len(query_terms & terms) / len(query_terms)
+            if codes:
+                sku_hits[i] = len(codes & terms) / len(codes)
+        return _min_max(first_stage) + COVERAGE_WEIGHT * coverage + SKU_WEIGHT * sku_hits
+
+    def _cross_encoder_scores(self, query, docs):
+        if "cross_encoder" not in loaded_models():
+            # Never stall a query on the model download/load; use it once it is ready
+            if self._loading is None:
+                self._loading = threading.Thread(target=get_cross_encoder, name="rerank-load", daemon=True)
+                self._loading.start()
+            self.stats["not_ready"] += 1
+            return None
+
+        pairs = [(query, doc.get("content", "")) for doc in docs]
+
+        def predict():
+            # All pairs in one batch: one forward pass
+            return np.asarray(
+                get_cross_encoder().predict(pairs, batch_size=len(pairs), show_progress_bar=False),
+                dtype=np.float32
+            )
+
+        if self.executor is None:
+            return predict()
+        future = self.executor.submit(predict)
+        try:
+            return future.result(timeout=self.budget)
+        except FutureTimeoutError:
+            future.cancel()
+            self.stats["timeouts"] += 1
+            return None
@@ -1,10 +1,18 @@
 import os
+import numpy as np
 import pymongo
 import torch
 
-from sentence_transformers import SentenceTransformer
 from dotenv import load_dotenv
-import open_clip
+
+from src.core.ann import ANN_NPROBE
+from src.core.models import DEVICE, get_clip_text_encoder, get_clip_tokenizer, get_text_model
+from src.core.lexical import HYBRID_FUSION, fuse_scores, keyword_terms, tokenize
+from src.core.scoring import normalize, normalize_rows, scatter, top_k_indices
+from src.core.vector_index import INDEX_REGISTRY
+from src.utils.cache import LRUCache, normalize_query
+from src.utils.db_helpers import ensure_indexes
+from src.utils.metrics import span
 
 load_dotenv()
 
@@ -16,7 +24,27 @@ COLLECTION_NAME = os.getenv("COLLECTION_NAME", "embeddings_rag")
 TOP_K_TEXT = 5
 TOP_K_IMAGE = 4
 
-DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+# When an ANN engine is active, fetch this many times top_k before re-ranking
+ANN_OVERFETCH = int(os.getenv("ANN_OVERFETCH", "10"))
+
+# "atlas" ranks with a $vectorSearch aggregation (MongoDB Atlas), "local" scores in
+# process. Atlas needs embeddings stored as float arrays (EMBEDDING_STORAGE=float)
+# and vector indexes on the fields below with tenant_id and type as filter fields.
+# Atlas ranking is vector-only; BM25 fusion needs the local index. A deployment
+# without $vectorSearch falls back to local scoring.
+VECTOR_SEARCH = os.getenv("VECTOR_SEARCH", "local")
+VECTOR_SEARCH_INDEXES = {
+    "text": os.getenv("VECTOR_SEARCH_INDEX_TEXT", "text_vector_index"),
+    "image": os.getenv("VECTOR_SEARCH_INDEX_IMAGE", "image_vector_index"),
+}
+
+# Exact-match caches for repeated query strings (0 entries disables a cache)
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", "4096"))
+RESULT_CACHE_SIZE = int(os.getenv("RESULT_CACHE_SIZE", "4096"))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "32"))
+
+# Batch search scores queries in chunks whose (queries x rows) score matrix stays below this
+BATCH_SCORE_MAX_MB = float(os.getenv("BATCH_SCORE_MAX_MB", "64"))
 
 
 class Retriever:
@@ -24,85 +52,309 @@ class Retriever:
         # MongoDB
         self.client = pymongo.MongoClient(MONGO_URI)
         self.collection = self.client[DB_NAME][COLLECTION_NAME]
+        try:
+            ensure_indexes(self.collection)
+        except pymongo.errors.PyMongoError as e:
+            print(f"⚠️ Could not verify MongoDB indexes: {e}")
+        self.indexes = INDEX_REGISTRY
+        self.nprobe = ANN_NPROBE  # ANN recall/latency knob, adjustable at runtime
+        self.fusion = HYBRID_FUSION  # "boost", "bm25" or "rrf"
+        self.vector_search = VECTOR_SEARCH
 
-        # Text embedding model
-        self.text_model = SentenceTransformer("all-MiniLM-L6-v2")
+        # (model, query) -> normalized embedding. MiniLM and the CLIP tokenizer are
+        # both case-insensitive, so normalized query strings share one entry.
+        self.embedding_cache = LRUCache(QUERY_EMBEDDING_CACHE_SIZE)
+        # (tenant, type, query, top_k, knobs) -> (index version, results)
+        self.result_cache = LRUCache(RESULT_CACHE_SIZE, int(RESULT_CACHE_MAX_MB * 1024 * 1024))
 
-        # CLIP model for image retrieval
-        self.clip_model, _, _ = open_clip.create_model_and_transforms(
-            "ViT-B-32", pretrained="openai"
-        )
-        self.clip_model = self.clip_model.to(DEVICE)
-        self.clip_tokenizer = open_clip.get_tokenizer("ViT-B-32")
+    # ---------------- MODELS (shared, loaded on first use) ----------------
+    @property
+    def text_model(self):
+        return get_text_model()
+
+    @property
+    def clip_model(self):
+        # Text tower only, unless this process already holds the full CLIP
+        return get_clip_text_encoder()
+
+    @property
+    def clip_tokenizer(self):
+        return get_clip_tokenizer()
+
+    # ---------------- QUERY ENCODING ----------------
+    def _cached_embedding(self, model_name, query, encode):
+        if not QUERY_EMBEDDING_CACHE_SIZE:
+            return encode(query)
+        key = (model_name, normalize_query(query))
+        query_emb = self.embedding_cache.get(key)
+        if query_emb is None:
+            query_emb = encode(query)
+            query_emb.setflags(write=False)  # shared between callers
+            self.embedding_cache.put(key, query_emb)
+        return query_emb
+
+    def encode_text_query(self, query):
+        """L2-normalized MiniLM embedding of a query."""
+        def encode(q):
+            with span("query.embed_text"):
+                return normalize(self.text_model.encode(q))
+        return self._cached_embedding("text", query, encode)
+
+    def encode_clip_query(self, query):
+        """L2-normalized CLIP text embedding of a query."""
+        def encode(q):
+            with span("query.embed_clip"):
+                tokens = self.clip_tokenizer([q]).to(DEVICE)
+                with torch.no_grad():
+                    return normalize(self.clip_model.encode_text(tokens)[0].cpu().numpy())
+        return self._cached_embedding("clip", query, encode)
+
+    def _cached_embeddings(self, model_name, queries, encode_many):
+        """Embedding matrix (one row per query); every cache miss is encoded in one batch."""
+        embs = [None] * len(queries)
+        missing = {}  # normalized query -> positions
+        for i, query in enumerate(queries):
+            key = normalize_query(query)
+            if QUERY_EMBEDDING_CACHE_SIZE:
+                embs[i] = self.embedding_cache.get((model_name, key))
+            if embs[i] is None:
+                missing.setdefault(key, []).append(i)
+
+        if missing:
+            encoded = encode_many([queries[positions[0]] for positions in missing.values()])
+            for (key, positions), query_emb in zip(missing.items(), encoded):
+                query_emb.setflags(write=False)
+                if QUERY_EMBEDDING_CACHE_SIZE:
+                    self.embedding_cache.put((model_name, key), query_emb)
+                for i in positions:
+                    embs[i] = query_emb
+        return np.stack(embs) if embs else np.zeros((0, 0), dtype=np.float32)
+
+    def encode_text_queries(self, queries):
+        """encode_text_query() for many queries, as one MiniLM batch."""
+        def encode(batch):
+            with span("query.embed_text"):
+                return normalize_rows(self.text_model.encode(batch, batch_size=len(batch)))
+        return self._cached_embeddings("text", queries, encode)
+
+    def encode_clip_queries(self, queries):
+        """encode_clip_query() for many queries, as one CLIP batch."""
+        def encode(batch):
+            with span("query.embed_clip"):
+                tokens = self.clip_tokenizer(batch).to(DEVICE)
+                with torch.no_grad():
+                    return normalize_rows(self.clip_model.encode_text(tokens).cpu().numpy())
+        return self._cached_embeddings("clip", queries, encode)
+
+    # ---------------- RESULT CACHE ----------------
+    def _result_key(self, index, query, top_k):
+        return (index.tenant_id, index.doc_type, normalize_query(query), top_k, self.fusion, self.nprobe)
+
+    def _cached_results(self, index, key):
+        if not RESULT_CACHE_SIZE:
+            return None
+        # Entries from before the tenant's last re-ingestion are dropped
+        entry = self.result_cache.get(key, valid=lambda e: e[0] == index.version)
+        if entry is None:
+            return None
+        # Callers decorate results in place (URLs), so hand out copies
+        return [dict(doc) for doc in entry[1]]
+
+    def _store_results(self, version, key, results):
+        # `version` is that of the index the results were scored on
+        if RESULT_CACHE_SIZE:
+            self.result_cache.put(key, (version, [dict(doc) for doc in results]))
+        return results
+
+    def cache_stats(self):
+        return {
+            "query_embeddings": self.embedding_cache.stats(),
+            "results": self.result_cache.stats(),
+        }
 
-    # ---------------- UTILS ----------------
-    @staticmethod
-    def cosine_similarity(v1, v2):
-        v1 = torch.tensor(v1)
-        v2 = torch.tensor(v2)
-        return torch.nn.functional.cosine_similarity(v1, v2, dim=0).item()
+    # ---------------- ATLAS VECTOR SEARCH ----------------
+    def _vector_search(self, tenant_id, doc_type, field, query_emb, top_k):
+        """
+        Top-k documents via $vectorSearch, or None if the deployment does not
+        support it (this retriever then stays on local scoring).
+        """
+        pipeline = [
+            {"$vectorSearch": {
+                "index": VECTOR_SEARCH_INDEXES[doc_type],
+                "path": field,
+                "queryVector": [float(x) for x in query_emb],
+                "numCandidates": top_k * ANN_OVERFETCH,
+                "limit": top_k,
+                "filter": {"tenant_id": tenant_id, "type": doc_type},
+            }},
+            {"$addFields": {"score": {"$meta": "vectorSearchScore"}}},
+            {"$project": {"embedding_text": 0, "embedding_clip": 0, "tokens": 0}},
+        ]
+        try:
+            with span("query.mongo_fetch"):
+                return list(self.collection.aggregate(pipeline))
+        except pymongo.errors.OperationFailure as e:
+            print(f"⚠️ $vectorSearch unavailable, falling back to local scoring: {e}")
+            self.vector_search = "local"
+            return None
 
     # ---------------- TEXT SEARCH ----------------
-    def search_text(self, query, tenant_id=None, top_k=TOP_K_TEXT):
-        query_emb = self.text_model.encode(query)
-
-        cursor = self.collection.find({
-            "tenant_id": tenant_id,
-            "type": "text"
-        })
-
-        # Keyword extract for boosting
-        keywords = [word.lower() for word in query.split() if len(word) > 3]
-
-        scored = []
-        for doc in cursor:
-            if "embedding_text" not in doc:
-                continue
-            
-            # Vector Score
-            vec_score = self.cosine_similarity(query_emb, doc["embedding_text"])
-            
-            # Keyword Boost
-            content_lower = doc.get("content", "").lower()
-            boost = 0
-            for kw in keywords:
-                if kw in content_lower:
-                    boost += 0.15 # Strong boost for keyword matches
-            
-            total_score = vec_score + boost
-            scored.append((total_score, doc))
-
-        scored.sort(key=lambda x: x[0], reverse=True)
-        # Add score to each doc
-        for s, d in scored:
-            d["score"] = s
-            
-        return [d for _, d in scored[:top_k]]
+    def search_text(self, query, tenant_id=None, top_k=TOP_K_TEXT, query_emb=None):
+        if self.vector_search == "atlas":
+            if query_emb is None:
+                query_emb = self.encode_text_query(query)
+            results = self._vector_search(tenant_id, "text", "embedding_text", query_emb, top_k)
+            if results is not None:
+                return results
+
+        with span("query.mongo_fetch"):
+            index = self.indexes.get(self.collection, tenant_id, "text", "embedding_text")
+        if not len(index):
+            return []
+        # Patches swap in a new index object, so this is the version of the rows scored below
+        version = index.version
+        cache_key = self._result_key(index, query, top_k)
+        cached = self._cached_results(index, cache_key)
+        if cached is not None:
+            return cached
+
+        # Callers that already encoded the query pass query_emb
+        if query_emb is None:
+            query_emb = self.encode_text_query(query)
+        with span("query.scoring"):
+            rows, scores = self._score_text(index, query, query_emb, top_k)
+        with span("query.mongo_fetch"):
+            results = index.docs(self.collection, rows, scores)
+        return self._store_results(version, cache_key, results)
+
+    def _score_text(self, index, query, query_emb, top_k, candidates=None):
+        """
+        Hybrid vector + lexical scoring; returns the top_k (rows, scores).
+        `candidates` are the query's (rows, vector scores) when already computed (batch search).
+        """
+        # Vector Score
+        limit = top_k * ANN_OVERFETCH
+        if candidates is None:
+            candidates = index.candidates(query_emb, limit, self.nprobe)
+        rows, vec_scores = candidates
+        dense = index.ann is None
+
+        # Lexical Score (BM25 over the posting lists of the query terms)
+        lex_rows, lex_found = index.lexical.search(tokenize(query))
+        if not dense and len(lex_rows):
+            # Strong lexical hits the ANN missed still get a vector score
+            best_lex = lex_rows[top_k_indices(lex_found, limit)]
+            extra = np.setdiff1d(best_lex, rows)
+            rows = np.concatenate((rows, extra))
+            vec_scores = np.concatenate((vec_scores, index.matrix[extra] @ query_emb))
+        lex_scores = scatter(rows, lex_rows, lex_found, dense)
+
+        # Keyword Boost (count of long query words present in the chunk)
+        keyword_hits = np.zeros(len(rows), dtype=np.float32)
+        if self.fusion == "boost":
+            for term in keyword_terms(query):
+                keyword_hits += scatter(rows, index.lexical.rows_with(term), 1.0, dense)
+
+        scores = fuse_scores(vec_scores, lex_scores, keyword_hits, self.fusion)
+        best = top_k_indices(scores, top_k)
+        return rows[best], scores[best]
 
     # ---------------- IMAGE SEARCH (TRUE MULTIMODAL) ----------------
     def search_images(self, query, tenant_id=None, top_k=TOP_K_IMAGE):
-        tokens = self.clip_tokenizer([query]).to(DEVICE)
-        with torch.no_grad():
-            query_emb = self.clip_model.encode_text(tokens)[0].cpu().tolist()
-
-        cursor = self.collection.find({
-            "tenant_id": tenant_id,
-            "type": "image"
-        })
-
-        scored = []
-        for doc in cursor:
-            if "embedding_clip" not in doc:
-                continue
-            score = self.cosine_similarity(query_emb, doc["embedding_clip"])
-            scored.append((score, doc))
-
-        scored.sort(key=lambda x: x[0], reverse=True)
-        # Add score to each doc
-        for s, d in scored:
-            d["score"] = s
-
-        return [d for _, d in scored[:top_k]]
+        if self.vector_search == "atlas":
+            results = self._vector_search(tenant_id, "image", "embedding_clip", self.encode_clip_query(query), top_k)
+            if results is not None:
+                return results
+
+        with span("query.mongo_fetch"):
+            index = self.indexes.get(self.collection, tenant_id, "image", "embedding_clip")
+        if not len(index):
+            return []
+        # Patches swap in a new index object, so this is the version of the rows scored below
+        version = index.version
+        cache_key = self._result_key(index, query, top_k)
+        cached = self._cached_results(index, cache_key)
+        if cached is not None:
+            return cached
+
+        query_emb = self.encode_clip_query(query)
+        with span("query.scoring"):
+            rows, scores = index.candidates(query_emb, top_k, self.nprobe)
+            best = top_k_indices(scores, top_k)
+        with span("query.mongo_fetch"):
+            results = index.docs(self.collection, rows[best], scores[best])
+        return self._store_results(version, cache_key, results)
+
+    # ---------------- BATCH SEARCH ----------------
+    def search_text_batch(self, queries, tenant_id=None, top_k=TOP_K_TEXT, query_embs=None):
+        """
+        search_text() for many queries of one tenant; returns one result list per query.
+        `query_embs` are the rows of encode_text_queries(queries) when already computed.
+        """
+        if query_embs is None:
+            query_embs = self.encode_text_queries(queries)
+        if self.vector_search == "atlas":
+            return [self.search_text(q, tenant_id, top_k, emb) for q, emb in zip(queries, query_embs)]
+
+        with span("query.mongo_fetch"):
+            index = self.indexes.get(self.collection, tenant_id, "text", "embedding_text")
+        if not len(index):
+            return [[] for _ in queries]
+        return self._search_batch(
+            index, queries, query_embs, top_k, top_k * ANN_OVERFETCH,
+            lambda query, query_emb, candidates: self._score_text(index, query, query_emb, top_k, candidates)
+        )
+
+    def search_images_batch(self, queries, tenant_id=None, top_k=TOP_K_IMAGE):
+        """search_images() for many queries of one tenant; returns one result list per query."""
+        query_embs = self.encode_clip_queries(queries)
+        if self.vector_search == "atlas":
+            results = []
+            for query_emb in query_embs:
+                found = self._vector_search(tenant_id, "image", "embedding_clip", query_emb, top_k)
+                if found is None:
+                    break
+                results.append(found)
+            else:
+                return results
+
+        with span("query.mongo_fetch"):
+            index = self.indexes.get(self.collection, tenant_id, "image", "embedding_clip")
+        if not len(index):
+            return [[] for _ in queries]
+
+        def best(query, query_emb, candidates):
+            rows, scores = candidates
+            top = top_k_indices(scores, top_k)
+            return rows[top], scores[top]
+        return self._search_batch(index, queries, query_embs, top_k, top_k, best)
+
+    def _search_batch(self, index, queries, query_embs, top_k, limit, rank):
+        """
+        Shared by the batch searches: serves cached results, scores the remaining
+        queries in chunks (one matrix-matrix product each for exact search), ranks
+        each with `rank(query, query_emb, candidates)` and fetches all of their
+        documents with one MongoDB query.
+        """
+        version = index.version
+        keys = [self._result_key(index, query, top_k) for query in queries]
+        results = [self._cached_results(index, key) for key in keys]
+        pending = [i for i, cached in enumerate(results) if cached is None]
+        if not pending:
+            return results
+
+        step = max(1, int(BATCH_SCORE_MAX_MB * 1024 * 1024) // (4 * len(index)))
+        hits = []
+        with span("query.scoring"):
+            for start in range(0, len(pending), step):
+                part = pending[start:start + step]
+                candidates = index.candidates_batch(query_embs[part], limit, self.nprobe)
+                hits.extend(rank(queries[i], query_embs[i], c) for i, c in zip(part, candidates))
+        with span("query.mongo_fetch"):
+            fetched = index.docs_many(self.collection, hits)
+        for i, docs in zip(pending, fetched):
+            results[i] = self._store_results(version, keys[i], docs)
+        return results
 
     # ---------------- HYBRID ----------------
     def search_hybrid(self, query, tenant_id=None):
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+def normalize(vec):
+    """Returns `vec` as an L2-normalized float32 array."""
+    vec = np.asarray(vec, dtype=np.float32).ravel()
+    norm = np.linalg.norm(vec)
+    return vec / norm if norm else vec
+
+
+def normalize_rows(matrix):
+    """Returns every row of `matrix` L2-normalized, as float32 (zero rows stay zero)."""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def cosine_scores(matrix, query_emb):
+    """
+    Cosine similarity of a query against every row of `matrix` in one matmul.
+    Rows must already be L2-normalized (ingestion and TenantIndex guarantee this).
+    """
+    return matrix @ normalize(query_emb)
+
+
+def top_k_indices(scores, k):
+    """Indices of the k highest scores, best first, without sorting the full array."""
+    n = len(scores)
+    if k <= 0 or n == 0:
+        return np.empty(0, dtype=np.int64)
+    if k < n:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(n)
+    return candidates[np.argsort(-scores[candidates], kind="stable")]
+
+
+def scatter(rows, sub_rows, values, dense=False):
+    """
+    Values aligned with `rows`, taken from (sub_rows, values) and 0 where a row is absent.
+    `dense=True` means rows is arange(len(rows)), which skips the lookup.
+    """
+    out = np.zeros(len(rows), dtype=np.float32)
+    if not len(sub_rows):
+        return out
+    if dense:
+        np.add.at(out, sub_rows, values)
+        return out
+
+    order = np.argsort(rows, kind="stable")
+    sorted_rows = rows[order]
+    pos = np.minimum(np.searchsorted(sorted_rows, sub_rows), len(rows) - 1)
+    found = sorted_rows[pos] == sub_rows
+    np.add.at(out, order[pos[found]], np.broadcast_to(values, sub_rows.shape)[found])
+    return out
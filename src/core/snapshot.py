@@ -0,0 +1,249 @@
+import os
+import shutil
+import pickle
+import tempfile
+from collections.abc import Mapping, Sequence
+from urllib.parse import quote
+
+import numpy as np
+from bson import ObjectId
+from dotenv import load_dotenv
+
+from src.core.ann import IVFIndex
+from src.core.lexical import BM25Index
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+# Local directory for per-tenant index snapshots; empty disables them
+INDEX_SNAPSHOT_DIR = os.getenv("INDEX_SNAPSHOT_DIR", "index_snapshots")
+
+# Layout: <INDEX_SNAPSHOT_DIR>/<database>.<collection>/t_<tenant>/<doc_type>/v<version>-<epoch>/
+#   vectors.npy           row-normalized float32 matrix
+#   row_ids.npy           \
+#   row_documents.npy      } row metadata by column: 12-byte ObjectIds, codes into
+#   row_pages.npy         /  meta.pkl's document names, page numbers (-1 = none)
+#   bm25_terms.npy        \
+#   bm25_offsets.npy       | BM25 postings in CSR form: sorted UTF-8 terms, and
+#   bm25_rows.npy          } term i's rows/tfs at [offsets[i]:offsets[i + 1]]
+#   bm25_tfs.npy           |
+#   bm25_doc_len.npy      /
+#   ivf_centroids.npy     \
+#   ivf_ids.npy            } IVF engine, when one was built
+#   ivf_offsets.npy       /
+#   meta.pkl              small items: document names, BM25 parameters (trusted local cache)
+# Every array except the IVF centroids/offsets is opened with mmap_mode="r", so
+# opening a snapshot copies almost nothing and workers share the page cache.
+# Metadata that does not fit the columns (non-ObjectId ids, extra fields) is
+# pickled into meta.pkl instead.
+# A snapshot directory is written under a temporary name and renamed into place,
+# so readers (possibly other worker processes) only ever see complete snapshots.
+# The database/collection directory keeps deployments that share INDEX_SNAPSHOT_DIR
+# apart, and the epoch (see get_tenant_epoch) keeps a restarted version counter
+# from matching snapshots of the data it replaced.
+
+
+def _tenant_dir(namespace, tenant_id):
+    return os.path.join(INDEX_SNAPSHOT_DIR, quote(namespace, safe="."), "t_" + quote(str(tenant_id), safe=""))
+
+
+def _snapshot_path(namespace, tenant_id, doc_type, version, epoch):
+    return os.path.join(_tenant_dir(namespace, tenant_id), doc_type, f"v{version}-{epoch}")
+
+
+class ColumnMetadata(Sequence):
+    """Read-only TenantIndex.metadata over the row_* columns; rows are built on access."""
+    def __init__(self, ids, document_codes, pages, documents):
+        self.ids = ids
+        self.document_codes = document_codes
+        self.pages = pages
+        self.documents = documents
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        row = {"_id": ObjectId(self.ids[i].tobytes())}
+        if self.document_codes[i] >= 0:
+            row["source_document"] = self.documents[self.document_codes[i]]
+        if self.pages[i] >= 0:
+            row["page_number"] = int(self.pages[i])
+        return row
+
+
+class FlatPostings(Mapping):
+    """Read-only BM25Index.postings over the bm25_* CSR arrays: term -> (rows, tfs)."""
+    def __init__(self, terms, offsets, rows, tfs):
+        self.terms = terms
+        self.offsets = offsets
+        self.rows = rows
+        self.tfs = tfs
+
+    def _position(self, term):
+        key = term.encode("utf-8")
+        if len(key) > self.terms.dtype.itemsize:
+            return None
+        i = int(np.searchsorted(self.terms, key))
+        return i if i < len(self.terms) and self.terms[i] == key else None
+
+    def __getitem__(self, term):
+        i = self._position(term)
+        if i is None:
+            raise KeyError(term)
+        start, end = self.offsets[i], self.offsets[i + 1]
+        return self.rows[start:end], self.tfs[start:end]
+
+    def __contains__(self, term):
+        return self._position(term) is not None
+
+    def __iter__(self):
+        return (term.decode("utf-8") for term in self.terms)
+
+    def __len__(self):
+        return len(self.terms)
+
+
+def _metadata_columns(metadata):
+    """(ids, document_codes, pages, documents) for `metadata`, or None if it does not fit the columns."""
+    documents = {}
+    ids = np.empty((len(metadata), 12), dtype=np.uint8)
+    codes = np.empty(len(metadata), dtype=np.int32)
+    pages = np.empty(len(metadata), dtype=np.int32)
+    for i, row in enumerate(metadata):
+        page = row.get("page_number", -1)
+        if not isinstance(row.get("_id"), ObjectId) or set(row) - {"_id", "source_document", "page_number"} \
+                or not isinstance(page, int) or page < -1:
+            return None
+        ids[i] = np.frombuffer(row["_id"].binary, dtype=np.uint8)
+        document = row.get("source_document")
+        codes[i] = -1 if document is None else documents.setdefault(document, len(documents))
+        pages[i] = page
+    return ids, codes, pages, list(documents)
+
+
+def _save_postings(path, lexical):
+    terms = sorted(lexical.postings)  # code point order = UTF-8 byte order, as searchsorted needs
+    encoded = np.array([term.encode("utf-8") for term in terms], dtype=bytes)
+    lengths = [len(lexical.postings[term][0]) for term in terms]
+    empty_rows, empty_tfs = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+    np.save(os.path.join(path, "bm25_terms.npy"), encoded if terms else np.empty(0, dtype="S1"))
+    np.save(os.path.join(path, "bm25_offsets.npy"), np.concatenate(([0], np.cumsum(lengths))).astype(np.int64))
+    np.save(os.path.join(path, "bm25_rows.npy"),
+            np.concatenate([lexical.postings[t][0] for t in terms]).astype(np.int64) if terms else empty_rows)
+    np.save(os.path.join(path, "bm25_tfs.npy"),
+            np.concatenate([lexical.postings[t][1] for t in terms]).astype(np.float32) if terms else empty_tfs)
+    np.save(os.path.join(path, "bm25_doc_len.npy"), np.asarray(lexical.doc_len, dtype=np.float32))
+
+
+def _load_postings(path, k1, b):
+    def load(name):
+        return np.load(os.path.join(path, name), mmap_mode="r")
+
+    lexical = BM25Index(k1, b)
+    lexical.postings = FlatPostings(load("bm25_terms.npy"), load("bm25_offsets.npy"),
+                                    load("bm25_rows.npy"), load("bm25_tfs.npy"))
+    lexical.doc_len = load("bm25_doc_len.npy")
+    return lexical
+
+
+def load_snapshot(namespace, tenant_id, doc_type, field, version, epoch):
+    """
+    Opens the snapshot for exactly `version` and `epoch` of the tenant's data in
+    `namespace` ("<database>.<collection>"), or returns None if there is none.
+    """
+    from src.core.vector_index import TenantIndex
+
+    if not INDEX_SNAPSHOT_DIR:
+        return None
+    path = _snapshot_path(namespace, tenant_id, doc_type, version, epoch)
+    if not os.path.isdir(path):
+        return None
+
+    try:
+        # mmap_mode keeps startup near-instant and lets workers share the page cache
+        matrix = np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")
+        with open(os.path.join(path, "meta.pkl"), "rb") as f:
+            meta = pickle.load(f)
+
+        metadata = meta.get("metadata")
+        if metadata is None:
+            metadata = ColumnMetadata(
+                np.load(os.path.join(path, "row_ids.npy"), mmap_mode="r"),
+                np.load(os.path.join(path, "row_documents.npy"), mmap_mode="r"),
+                np.load(os.path.join(path, "row_pages.npy"), mmap_mode="r"),
+                meta["documents"],
+            )
+        index = TenantIndex(tenant_id, doc_type, field, matrix, metadata, version)
+        index.lexical = _load_postings(path, *meta["bm25"]) if meta["bm25"] else None
+        if os.path.exists(os.path.join(path, "ivf_centroids.npy")):
+            ivf = IVFIndex(np.load(os.path.join(path, "ivf_centroids.npy")))
+            ids = np.load(os.path.join(path, "ivf_ids.npy"), mmap_mode="r")
+            offsets = np.load(os.path.join(path, "ivf_offsets.npy"))
+            ivf.lists = [ids[offsets[i]:offsets[i + 1]] for i in range(len(offsets) - 1)]
+            index.ann = ivf
+    except Exception as e:
+        print(f"⚠️ Ignoring unreadable index snapshot {path}: {e}")
+        return None
+
+    print(f"📂 Opened index snapshot: tenant {tenant_id} | {doc_type} | v{version} | {len(index)} rows")
+    return index
+
+
+def save_snapshot(namespace, index, epoch):
+    """Writes `index` as the snapshot for its version and `epoch` and removes older versions."""
+    if not INDEX_SNAPSHOT_DIR:
+        return
+
+    final_path = _snapshot_path(namespace, index.tenant_id, index.doc_type, index.version, epoch)
+    root = os.path.dirname(final_path)
+    if os.path.isdir(final_path):
+        return
+
+    os.makedirs(root, exist_ok=True)
+    tmp_path = tempfile.mkdtemp(prefix=".tmp-", dir=root)
+    try:
+        np.save(os.path.join(tmp_path, "vectors.npy"), np.ascontiguousarray(index.matrix))
+        meta = {"metadata": None, "documents": None, "bm25": None}
+        columns = _metadata_columns(index.metadata)
+        if columns is None:
+            meta["metadata"] = list(index.metadata)
+        else:
+            ids, codes, pages, meta["documents"] = columns
+            np.save(os.path.join(tmp_path, "row_ids.npy"), ids)
+            np.save(os.path.join(tmp_path, "row_documents.npy"), codes)
+            np.save(os.path.join(tmp_path, "row_pages.npy"), pages)
+        if index.lexical is not None:
+            _save_postings(tmp_path, index.lexical)
+            meta["bm25"] = (index.lexical.k1, index.lexical.b)
+        with open(os.path.join(tmp_path, "meta.pkl"), "wb") as f:
+            pickle.dump(meta, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+        if isinstance(index.ann, IVFIndex):
+            lengths = [len(ids) for ids in index.ann.lists]
+            np.save(os.path.join(tmp_path, "ivf_centroids.npy"), index.ann.centroids)
+            np.save(os.path.join(tmp_path, "ivf_ids.npy"), np.concatenate(index.ann.lists))
+            np.save(os.path.join(tmp_path, "ivf_offsets.npy"), np.concatenate(([0], np.cumsum(lengths))))
+
+        os.rename(tmp_path, final_path)
+    except OSError:
+        # Another process published this version first, or the disk is unavailable
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return
+
+    _remove_other_versions(root, keep=final_path)
+
+
+def delete_snapshots(namespace, tenant_id):
+    """Drops every snapshot of a tenant (its in-memory index changed)."""
+    if INDEX_SNAPSHOT_DIR:
+        shutil.rmtree(_tenant_dir(namespace, tenant_id), ignore_errors=True)
+
+
+def _remove_other_versions(root, keep):
+    # Open memmaps of removed files stay valid until their readers let go
+    for name in os.listdir(root):
+        path = os.path.join(root, name)
+        if path != keep and name.startswith("v"):
+            shutil.rmtree(path, ignore_errors=True)
@@ -0,0 +1,299 @@
+import os
+import copy
+import time
+import threading
+
+import numpy as np
+from dotenv import load_dotenv
+
+from src.core.ann import build_ann
+from src.core.lexical import BM25Index, tokenize
+from src.core.quantization import decode_matrix
+from src.core.scoring import cosine_scores
+from src.core.snapshot import delete_snapshots, load_snapshot, save_snapshot
+from src.utils.db_helpers import get_tenant_epoch, get_tenant_version
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+# Seconds a tenant's data version is trusted before MongoDB is asked again.
+# Ingestion in another process becomes visible to queries within this delay.
+TENANT_VERSION_TTL = float(os.getenv("TENANT_VERSION_TTL", "1"))
+
+# Per-row fields kept in memory: the _id for fetching results and what ingestion
+# needs to patch the index. Content and everything else is fetched for the top-k only.
+ROW_FIELDS = ("_id", "source_document", "page_number")
+EMBEDDING_FIELDS = ("embedding_text", "embedding_clip")
+
+
+def _normalize_rows(rows):
+    # Rows may be stored as lists or packed float16/int8 blobs
+    matrix = decode_matrix(rows)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return np.ascontiguousarray(matrix / norms, dtype=np.float32)
+
+
+class TenantIndex:
+    """
+    In-memory embeddings for one tenant and one record type.
+    Rows of `matrix` are L2-normalized float32, so a dot product is a cosine score.
+    `metadata[i]` holds the ROW_FIELDS of the record behind row i.
+    `ann` is an optional approximate engine (see src.core.ann) over the same rows.
+    `lexical` is a BM25 inverted index over the rows' content (text records only).
+    """
+    def __init__(self, tenant_id, doc_type, field, matrix, metadata, version=0):
+        self.tenant_id = tenant_id
+        self.doc_type = doc_type
+        self.field = field
+        self.matrix = matrix
+        self.metadata = metadata
+        self.version = version
+        self.ann = None
+        self.lexical = BM25Index() if doc_type == "text" else None
+
+    def __len__(self):
+        return len(self.metadata)
+
+    @classmethod
+    def from_collection(cls, collection, tenant_id, doc_type, field, version=0):
+        # Served by the (tenant_id, type) index; only scoring fields come back
+        projection = {name: 1 for name in ROW_FIELDS + (field,)}
+        if doc_type == "text":
+            projection["tokens"] = 1
+        cursor = collection.find({
+            "tenant_id": tenant_id,
+            "type": doc_type,
+            field: {"$exists": True}
+        }, projection)
+
+        rows = []
+        metadata = []
+        token_lists = []
+        for doc in cursor:
+            rows.append(doc.pop(field))
+            token_lists.append(doc.pop("tokens", None))
+            metadata.append(doc)
+
+        if not rows:
+            return cls(tenant_id, doc_type, field, np.zeros((0, 0), dtype=np.float32), [], version)
+
+        # Normalize once at load so queries never recompute document norms
+        index = cls(tenant_id, doc_type, field, _normalize_rows(rows), metadata, version)
+        if index.lexical is not None:
+            # Records ingested before tokens were stored are tokenized from their content
+            untokenized = [doc["_id"] for doc, tokens in zip(metadata, token_lists) if tokens is None]
+            if untokenized:
+                contents = {
+                    doc["_id"]: doc.get("content", "")
+                    for doc in collection.find({"_id": {"$in": untokenized}}, {"content": 1})
+                }
+                token_lists = [
+                    tokens if tokens is not None else tokenize(contents.get(doc["_id"], ""))
+                    for doc, tokens in zip(metadata, token_lists)
+                ]
+            index.lexical.add(token_lists, 0)
+        return index
+
+    def copy(self):
+        """
+        A copy that can be patched (append/remove) while queries keep reading this
+        one. Arrays are only ever replaced, never written in place, so they are
+        shared; only the containers that patches mutate are duplicated.
+        """
+        clone = copy.copy(self)
+        clone.metadata = list(self.metadata)
+        if self.lexical is not None:
+            clone.lexical = copy.copy(self.lexical)
+            clone.lexical.postings = dict(self.lexical.postings)
+        if self.ann is not None:
+            clone.ann = copy.copy(self.ann)
+            clone.ann.lists = list(self.ann.lists)
+        return clone
+
+    def build_ann(self):
+        self.ann = build_ann(self.matrix) if len(self) else None
+
+    def candidates(self, query_emb, k, nprobe=None):
+        """
+        Returns (rows, scores) to rank for a query. With an ANN engine this is its
+        approximate top-k; otherwise every row is returned with its exact score.
+        """
+        if self.ann is None:
+            return np.arange(len(self)), cosine_scores(self.matrix, query_emb)
+        return self.ann.search(self.matrix, query_emb, k, nprobe)
+
+    def candidates_batch(self, query_embs, k, nprobe=None):
+        """
+        candidates() for every row of `query_embs` (L2-normalized). Exact search
+        scores all queries with one matrix-matrix product.
+        """
+        if self.ann is None:
+            rows = np.arange(len(self))
+            return [(rows, scores) for scores in query_embs @ self.matrix.T]
+        return [self.ann.search(self.matrix, query_emb, k, nprobe) for query_emb in query_embs]
+
+    def docs(self, collection, rows, scores):
+        """
+        Fetches the full documents (without embeddings) behind `rows` by _id, in row
+        order and with their scores. Rows deleted from MongoDB meanwhile are skipped.
+        """
+        return self.docs_many(collection, [(rows, scores)])[0]
+
+    def docs_many(self, collection, hits):
+        """docs() for a list of (rows, scores) pairs, with a single MongoDB query."""
+        ids = [[self.metadata[i]["_id"] for i in rows] for rows, _ in hits]
+        projection = {name: 0 for name in EMBEDDING_FIELDS + ("tokens",)}
+        unique_ids = list({_id for row_ids in ids for _id in row_ids})
+        found = {doc["_id"]: doc for doc in collection.find({"_id": {"$in": unique_ids}}, projection)}
+
+        results = []
+        for row_ids, (_, scores) in zip(ids, hits):
+            docs = []
+            for _id, score in zip(row_ids, scores):
+                doc = found.get(_id)
+                if doc is not None:
+                    # Copied: the same document can rank for several queries
+                    docs.append(dict(doc, score=float(score)))
+            results.append(docs)
+        return results
+
+    def append(self, records):
+        """Adds freshly inserted records without reloading the tenant from MongoDB."""
+        records = [r for r in records if r.get("type") == self.doc_type and self.field in r]
+        if not records:
+            return
+
+        new_rows = _normalize_rows([r[self.field] for r in records])
+        first_row = len(self)
+        self.matrix = new_rows if first_row == 0 else np.vstack((self.matrix, new_rows))
+        # Records carry their _id once insert_many has stored them
+        self.metadata.extend({k: r[k] for k in ROW_FIELDS if k in r} for r in records)
+        if self.lexical is not None:
+            self.lexical.add([
+                r["tokens"] if r.get("tokens") is not None else tokenize(r.get("content", ""))
+                for r in records
+            ], first_row)
+
+        if self.ann is not None:
+            self.ann.add(new_rows, np.arange(first_row, len(self)))
+        else:
+            self.build_ann()
+
+    def remove(self, predicate):
+        """Drops every row whose metadata matches `predicate`."""
+        keep = np.array([not predicate(doc) for doc in self.metadata], dtype=bool)
+        if keep.all():
+            return
+
+        self.matrix = np.ascontiguousarray(self.matrix[keep])
+        self.metadata = [doc for doc, k in zip(self.metadata, keep) if k]
+        if self.lexical is not None:
+            self.lexical.remap(keep)
+        if self.ann is not None and len(self):
+            self.ann.remap(keep)
+        else:
+            self.ann = None
+
+
+class IndexRegistry:
+    """
+    Process-wide cache of TenantIndex objects keyed by (tenant_id, doc_type).
+    Indexes are loaded lazily on first use and reloaded when the tenant's
+    data version (bumped by IngestionPipeline.run) moves on. A local snapshot
+    of the same version is memory-mapped when available; otherwise the index
+    is rebuilt from MongoDB and snapshotted. Writes made by an ingestion in the
+    same process are applied to a copy that then replaces the index, so a query
+    always reads one consistent version.
+    Tenant versions are cached for `version_ttl` seconds (see version()), so a
+    query does not pay a MongoDB round trip just to learn nothing changed.
+    """
+    def __init__(self, version_ttl=TENANT_VERSION_TTL):
+        self._indexes = {}
+        self._lock = threading.Lock()
+        self.version_ttl = version_ttl
+        self._versions = {}  # tenant_id -> (version, time.monotonic() it was read)
+        self._namespaces = {}  # tenant_id -> "<database>.<collection>" its indexes came from
+
+    def version(self, db, tenant_id):
+        """
+        The tenant's data version, read from MongoDB at most once per `version_ttl`.
+        Changes made through this registry (apply_*, invalidate) take effect at once.
+        """
+        cached = self._versions.get(tenant_id)
+        if cached is not None and time.monotonic() - cached[1] < self.version_ttl:
+            return cached[0]
+        version = get_tenant_version(db, tenant_id)
+        with self._lock:
+            cached = self._versions.get(tenant_id)
+            # A read that raced with a local patch must not bring back the older version
+            if cached is not None and cached[0] > version and time.monotonic() - cached[1] < self.version_ttl:
+                return cached[0]
+            self._versions[tenant_id] = (version, time.monotonic())
+        return version
+
+    def get(self, collection, tenant_id, doc_type, field):
+        key = (tenant_id, doc_type)
+        version = self.version(collection.database, tenant_id)
+
+        index = self._indexes.get(key)
+        if index is not None and index.version == version:
+            return index
+
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None or index.version != version:
+                namespace = f"{collection.database.name}.{collection.name}"
+                epoch = get_tenant_epoch(collection.database, tenant_id)
+                index = load_snapshot(namespace, tenant_id, doc_type, field, version, epoch)
+                if index is None:
+                    index = TenantIndex.from_collection(collection, tenant_id, doc_type, field, version)
+                    index.build_ann()
+                    save_snapshot(namespace, index, epoch)
+                self._indexes[key] = index
+                self._namespaces[tenant_id] = namespace
+        return index
+
+    def _patch(self, tenant_id, version, apply):
+        with self._lock:
+            for key in [k for k in self._indexes if k[0] == tenant_id]:
+                index = self._indexes[key]
+                # Only patch if nobody else changed the tenant in between
+                if index.version != version - 1:
+                    del self._indexes[key]
+                    continue
+                patched = index.copy()
+                apply(patched)
+                patched.version = version
+                self._indexes[key] = patched
+            self._versions[tenant_id] = (version, time.monotonic())
+            # On-disk snapshots no longer match; the next cold load rewrites them
+            if tenant_id in self._namespaces:
+                delete_snapshots(self._namespaces[tenant_id], tenant_id)
+
+    def apply_insert(self, tenant_id, records, version):
+        self._patch(tenant_id, version, lambda index: index.append(records))
+
+    def apply_delete(self, tenant_id, predicate, version):
+        self._patch(tenant_id, version, lambda index: index.remove(predicate))
+
+    def apply_replace(self, tenant_id, predicate, records, version):
+        """Removes the rows matching `predicate` and appends `records` as one change."""
+        def replace(index):
+            index.remove(predicate)
+            index.append(records)
+        self._patch(tenant_id, version, replace)
+
+    def put(self, index):
+        """Installs a prebuilt index (e.g. synthetic data for benchmarks) for its tenant and type."""
+        with self._lock:
+            self._indexes[(index.tenant_id, index.doc_type)] = index
+
+    def invalidate(self, tenant_id):
+        with self._lock:
+            self._versions.pop(tenant_id, None)
+            for key in [k for k in self._indexes if k[0] == tenant_id]:
+                del self._indexes[key]
+
+
+INDEX_REGISTRY = IndexRegistry()
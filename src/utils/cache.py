@@ -0,0 +1,122 @@
+import sys
+import time
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+def normalize_query(query):
+    """Case- and whitespace-insensitive cache key for a query string."""
+    return " ".join(query.lower().split())
+
+
+def approx_size(obj):
+    """Rough in-memory footprint of a cached value (bytes), following dicts, lists and arrays."""
+    if isinstance(obj, np.ndarray):
+        return obj.nbytes + 112
+    if isinstance(obj, dict):
+        return sys.getsizeof(obj) + sum(approx_size(k) + approx_size(v) for k, v in obj.items())
+    if isinstance(obj, (list, tuple, set, frozenset)):
+        return sys.getsizeof(obj) + sum(approx_size(item) for item in obj)
+    return sys.getsizeof(obj)
+
+
+class LRUCache:
+    """
+    Thread-safe LRU cache bounded by entry count and (optionally) approximate
+    memory, with an optional time-to-live. A limit of 0 disables that bound.
+    `on_evict(key)` is called for every entry that leaves the cache other than
+    through pop()/clear(): LRU eviction, memory pressure or expiry.
+    """
+    def __init__(self, max_entries=1024, max_bytes=0, ttl=0, sizeof=approx_size, on_evict=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.sizeof = sizeof
+        self.on_evict = on_evict
+        self._data = OrderedDict()  # key -> (value, size, expires_at)
+        self._lock = threading.RLock()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        with self._lock:
+            return self._live(key) is not None
+
+    def _live(self, key):
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        if entry[2] and entry[2] < time.monotonic():
+            self._evict(key)
+            return None
+        return entry
+
+    def _evict(self, key):
+        _, size, _ = self._data.pop(key)
+        self.bytes -= size
+        self.evictions += 1
+        if self.on_evict:
+            self.on_evict(key)
+
+    def get(self, key, default=None, valid=None):
+        """Returns the cached value; an entry for which `valid(value)` is false is dropped as a miss."""
+        with self._lock:
+            entry = self._live(key)
+            if entry is not None and valid is not None and not valid(entry[0]):
+                self.pop(key)
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value):
+        size = self.sizeof(value)
+        if self.max_bytes and size > self.max_bytes:
+            return  # would evict everything else and still not fit
+        expires_at = time.monotonic() + self.ttl if self.ttl else 0
+        with self._lock:
+            old = self._data.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._data[key] = (value, size, expires_at)
+            self.bytes += size
+            while self._data and (
+                (self.max_entries and len(self._data) > self.max_entries)
+                or (self.max_bytes and self.bytes > self.max_bytes)
+            ):
+                self._evict(next(iter(self._data)))
+
+    def pop(self, key, default=None):
+        with self._lock:
+            entry = self._data.pop(key, None)
+            if entry is None:
+                return default
+            self.bytes -= entry[1]
+            return entry[0]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.bytes = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._data),
+                "bytes": self.bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+            }
@@ -1,4 +1,5 @@
 import os
+import uuid
 import pymongo
 from pymongo import MongoClient
 from dotenv import load_dotenv
@@ -8,11 +9,66 @@ load_dotenv()
 MONGO_URI = os.getenv("MONGODB_URI", "mongodb://localhost:27017/")
 DB_NAME = os.getenv("DATABASE_NAME", "GenAi")
 COLLECTION_NAME = os.getenv("COLLECTION_NAME", "embeddings_rag")
+VERSION_COLLECTION_NAME = os.getenv("VERSION_COLLECTION_NAME", "tenant_versions")
+
+# Compound indexes behind tenant-scoped search and per-page re-ingestion
+REQUIRED_INDEXES = {
+    "tenant_type": [("tenant_id", 1), ("type", 1)],
+    "tenant_document_page": [("tenant_id", 1), ("source_document", 1), ("page_number", 1)],
+}
 
 def get_collection():
     client = MongoClient(MONGO_URI)
     return client[DB_NAME][COLLECTION_NAME], client
 
+def get_tenant_version(db, tenant_id):
+    """Returns the data version of a tenant (0 if it was never ingested)."""
+    doc = db[VERSION_COLLECTION_NAME].find_one({"_id": tenant_id})
+    return doc["version"] if doc else 0
+
+def get_tenant_epoch(db, tenant_id):
+    """
+    Random id of a tenant's version counter (None if it was never ingested). A
+    recreated tenant_versions collection restarts the counters under new epochs,
+    so (version, epoch) identifies the data even across such resets.
+    """
+    versions = db[VERSION_COLLECTION_NAME]
+    doc = versions.find_one({"_id": tenant_id}, {"epoch": 1})
+    if doc is None:
+        return None
+    if "epoch" not in doc:
+        # Counter created before epochs existed
+        versions.update_one({"_id": tenant_id, "epoch": {"$exists": False}}, {"$set": {"epoch": uuid.uuid4().hex}})
+        doc = versions.find_one({"_id": tenant_id}, {"epoch": 1})
+    return doc["epoch"]
+
+def bump_tenant_version(db, tenant_id):
+    """Marks a tenant's data as changed so in-memory search structures get rebuilt."""
+    doc = db[VERSION_COLLECTION_NAME].find_one_and_update(
+        {"_id": tenant_id},
+        {"$inc": {"version": 1}, "$setOnInsert": {"epoch": uuid.uuid4().hex}},
+        upsert=True,
+        return_document=pymongo.ReturnDocument.AFTER
+    )
+    return doc["version"]
+
+def ensure_indexes(collection):
+    """Creates any missing REQUIRED_INDEXES on `collection`, then verifies they exist."""
+    def existing_keys():
+        return [[tuple(k) for k in info["key"]] for info in collection.index_information().values()]
+
+    present = existing_keys()
+    for name, keys in REQUIRED_INDEXES.items():
+        # Matching keys under another name count too; recreating them would conflict
+        if keys not in present:
+            print(f"🗂️ Creating index {name} on {collection.name}")
+            collection.create_index(keys, name=name)
+
+    present = existing_keys()
+    missing = [name for name, keys in REQUIRED_INDEXES.items() if keys not in present]
+    if missing:
+        raise RuntimeError(f"Missing MongoDB indexes on {collection.name}: {missing}")
+
 def verify_tenant_data(tenant_id):
     """Checks document counts and samples for a specific tenant."""
     col, client = get_collection()
@@ -35,6 +91,7 @@ def wipe_tenant_data(tenant_id):
     col, client = get_collection()
     print(f"⚠️ Wiping all data for tenant: {tenant_id}")
     result = col.delete_many({"tenant_id": tenant_id})
+    bump_tenant_version(col.database, tenant_id)
     print(f"✅ Deleted {result.deleted_count} records.")
     client.close()
 
@@ -0,0 +1,142 @@
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Ensure project root is in path when run as a script
+sys.path.append(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))))
+
+# ---------------- STAND-IN LLM SERVER ----------------
+# Mimics the parts of the Ollama (/api/generate) and OpenAI (/v1/chat/completions)
+# APIs that LLMNode uses, so pooling, timeouts, retries and streaming can be
+# exercised locally. Point LLMNode at it with
+#   OLLAMA_BASE_URL=http://127.0.0.1:<port>
+#   OPENAI_BASE_URL=http://127.0.0.1:<port>/v1
+STUB_ANSWER = "This is a stub answer from the local LLM server."
+
+
+class StubLLMHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1 keeps connections open between requests, like the real providers
+    protocol_version = "HTTP/1.1"
+
+    def setup(self):
+        super().setup()
+        with self.server.stats_lock:
+            self.server.stats["connections"] += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        with self.server.stats_lock:
+            self.server.stats["requests"] += 1
+            # Fail the first N requests to exercise client retries
+            fail = self.server.stats["requests"] <= self.server.fail_first
+
+        if fail:
+            self._send_json({"error": "stub overloaded"}, status=503)
+            return
+        time.sleep(self.server.latency)
+
+        if self.path == "/api/generate":
+            self._ollama(body)
+        elif self.path == "/v1/chat/completions":
+            self._openai(body)
+        else:
+            self._send_json({"error": f"unknown path {self.path}"}, status=404)
+
+    def _ollama(self, body):
+        if not body.get("stream"):
+            self._send_json({"model": body.get("model"), "response": STUB_ANSWER, "done": True})
+            return
+        self._start_chunked("application/x-ndjson")
+        for word in STUB_ANSWER.split(" "):
+            self._write_chunk(json.dumps({"response": word + " ", "done": False}) + "\n")
+        self._write_chunk(json.dumps({"response": "", "done": True}) + "\n")
+        self._end_chunked()
+
+    def _openai(self, body):
+        if not body.get("stream"):
+            self._send_json({
+                "model": body.get("model"),
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": STUB_ANSWER}}],
+            })
+            return
+        self._start_chunked("text/event-stream")
+        for word in STUB_ANSWER.split(" "):
+            chunk = {"choices": [{"index": 0, "delta": {"content": word + " "}}]}
+            self._write_chunk(f"data: {json.dumps(chunk)}\n\n")
+        self._write_chunk("data: [DONE]\n\n")
+        self._end_chunked()
+
+    # ---------------- HTTP HELPERS ----------------
+    def _send_json(self, payload, status=200):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _start_chunked(self, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, text):
+        data = text.encode("utf-8")
+        self.wfile.write(f"{len(data):X}\r\n".encode("ascii") + data + b"\r\n")
+        self.wfile.flush()
+
+    def _end_chunked(self):
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+
+def make_server(host="127.0.0.1", port=0, latency=0.0, fail_first=0):
+    """
+    Builds a stand-in server (port 0 picks a free port). `latency` seconds are
+    added to every answer; the first `fail_first` requests get a 503.
+    server.stats counts accepted TCP connections and requests.
+    """
+    server = ThreadingHTTPServer((host, port), StubLLMHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    server.fail_first = fail_first
+    server.stats = {"connections": 0, "requests": 0}
+    server.stats_lock = threading.Lock()
+    return server
+
+
+def serve_in_thread(**kwargs):
+    """Starts a stand-in server on a daemon thread and returns (server, base_url)."""
+    server = make_server(**kwargs)
+    thread = threading.Thread(target=server.serve_forever, name="llm-stub", daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, f"http://{host}:{port}"
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local stand-in for the Ollama / OpenAI HTTP APIs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11434)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every answer")
+    parser.add_argument("--fail-first", type=int, default=0, help="Answer the first N requests with 503")
+    args = parser.parse_args()
+
+    server = make_server(args.host, args.port, args.latency, args.fail_first)
+    print(f"🧪 Stub LLM server on http://{args.host}:{args.port} (latency {args.latency}s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(f"📊 {server.stats['connections']} connections | {server.stats['requests']} requests")
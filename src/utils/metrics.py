@@ -0,0 +1,131 @@
+import os
+import time
+import threading
+import contextvars
+from bisect import bisect_left
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# ---------------- CONFIG ----------------
+# Set METRICS=0 to turn every span into a no-op (per-request timings still work when asked for)
+METRICS_ENABLED = os.getenv("METRICS", "1") == "1"
+# Upper bounds (seconds) of the latency histogram buckets
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last slot is +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class MetricsRegistry:
+    """Process-wide latency histograms, one per stage name (e.g. "query.llm")."""
+    def __init__(self, enabled=METRICS_ENABLED):
+        self.enabled = enabled
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            histogram = self._histograms.get(stage)
+            if histogram is None:
+                histogram = self._histograms[stage] = Histogram()
+            histogram.observe(seconds)
+
+    def snapshot(self):
+        """{stage: (count, total_seconds)} for computing per-stage deltas."""
+        with self._lock:
+            return {stage: (h.count, h.sum) for stage, h in self._histograms.items()}
+
+    def render(self):
+        """Prometheus text exposition format."""
+        lines = [
+            "# HELP rag_stage_seconds Latency of query and ingestion stages.",
+            "# TYPE rag_stage_seconds histogram",
+        ]
+        with self._lock:
+            for stage, histogram in sorted(self._histograms.items()):
+                cumulative = 0
+                for bound, count in zip(histogram.buckets + ("+Inf",), histogram.counts):
+                    cumulative += count
+                    lines.append(f'rag_stage_seconds_bucket{{stage="{stage}",le="{bound}"}} {cumulative}')
+                lines.append(f'rag_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+                lines.append(f'rag_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        return "\n".join(lines) + "\n"
+
+
+METRICS = MetricsRegistry()
+
+# Spans of the current request, when it asked for per-request timings
+_request_timings = contextvars.ContextVar("request_timings", default=None)
+_NOOP = nullcontext()
+
+
+class _Span:
+    __slots__ = ("stage", "timings", "start")
+
+    def __init__(self, stage, timings):
+        self.stage = stage
+        self.timings = timings
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        observe(self.stage, time.perf_counter() - self.start, self.timings)
+        return False
+
+
+def span(stage):
+    """Times the enclosed block as `stage`; a shared no-op when nothing would record it."""
+    timings = _request_timings.get()
+    if timings is None and not METRICS.enabled:
+        return _NOOP
+    return _Span(stage, timings)
+
+
+def observe(stage, seconds, timings=None):
+    """Records a duration measured elsewhere (e.g. in a worker process)."""
+    if timings is None:
+        timings = _request_timings.get()
+    if METRICS.enabled:
+        METRICS.observe(stage, seconds)
+    if timings is not None:
+        timings.append((stage, seconds))
+
+
+@contextmanager
+def collect_timings():
+    """
+    Collects the spans of the enclosed request, including work run through bind()
+    on other threads. Yields a dict that is filled with {stage: milliseconds} on exit.
+    """
+    timings = []
+    token = _request_timings.set(timings)
+    summary = {}
+    try:
+        yield summary
+    finally:
+        _request_timings.reset(token)
+        for stage, seconds in timings:
+            summary[stage] = summary.get(stage, 0.0) + seconds * 1000.0
+        for stage in summary:
+            summary[stage] = round(summary[stage], 3)
+
+
+def bind(fn):
+    """Wraps `fn` to run in a copy of the caller's context, so executor threads report into its request."""
+    return partial(contextvars.copy_context().run, fn)